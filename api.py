@@ -1,146 +1,435 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from fastapi.responses import StreamingResponse
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse
 from io import BytesIO
+from typing import List, Optional
+import asyncio
+import json
 import os
-import pandas as pd
-from docx import Document
-from pdf2docx import Converter
-import pdfplumber
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-import pypandoc
+import shutil
 import uvicorn
 
+from conversion import metrics
+from conversion.pool import ConversionPool, ConversionError, ConversionTimeout, PoolBusy, WarmPool
+from conversion import converters, docx_pdf
+from conversion.converters import CONVERTERS
+from conversion.registry import NoRoute, describe, run_route
+from conversion.cache import ResultCache, make_cache_key
+from conversion.cloud_export import ExportError, check_destination, export_file
+from conversion.jobs import JobQueue
+from conversion.pdf_pages import PageRangeError
+from conversion.scratch import cleanup_scratch
+from conversion.sheet_engines import is_sheet_archive
+from conversion.spool import spool_upload, new_spool_path, convert_into_file, open_and_unlink, iter_chunks, iter_zip
+
+# Process pool that runs the CPU-bound converters off the event loop
+conversion_pool = ConversionPool()
+# DOCX→PDF gets its own pre-started workers (pandoc + wkhtmltopdf) behind a bounded queue
+docx_pdf_pool = WarmPool(
+    "docx_pdf",
+    workers=docx_pdf.DOCX_PDF_WORKERS,
+    max_tasks_per_child=docx_pdf.DOCX_PDF_MAX_JOBS,
+    initializer=converters.warm_up,
+    health_check=docx_pdf.health_check,
+    queue_size=docx_pdf.DOCX_PDF_QUEUE_SIZE,
+    queue_timeout=docx_pdf.DOCX_PDF_QUEUE_TIMEOUT,
+    health_interval=docx_pdf.DOCX_PDF_HEALTH_INTERVAL,
+)
+# Converted outputs keyed on input content + conversion parameters
+result_cache = ResultCache()
+
+@asynccontextmanager
+async def lifespan(app):
+    cleanup_scratch() # Leftovers of crashed workers and older versions
+    conversion_pool.start()
+    docx_pdf_pool.start_monitor()
+    job_queue.start()
+    yield
+    await job_queue.stop()
+    await docx_pdf_pool.stop()
+    conversion_pool.shutdown()
+
 # Initialize FastAPI app
-app = FastAPI(title="File2File Conversion API")
+app = FastAPI(title="File2File Conversion API", lifespan=lifespan)
 
-# Supported formats (must match frontend)
-doc_types = ["pdf", "docx", "txt"]
-sheet_types = ["csv", "xls", "xlsx"]
+@app.middleware("http")
+async def timing_middleware(request: Request, call_next):
+    # Per-stage timings of conversions made while handling the request end up in a
+    # Server-Timing header; streaming the body happens later and is only in /metrics
+    requested = request.headers.get(metrics.PROFILE_HEADER) == "1"
+    timings = metrics.Timings(profile=metrics.should_profile(requested))
+    with metrics.HTTP_IN_FLIGHT.track(), metrics.collect(timings):
+        response = await call_next(request)
+    response.headers["Server-Timing"] = timings.server_timing()
+    if timings.profiles:
+        response.headers[metrics.PROFILE_HEADER] = ", ".join(timings.profiles)
+    return response
 
-# Function for document (PDF, DOCX, TXT) conversions - Reused from Streamlit app
-def convert_doc_file_backend(file_bytes_io: BytesIO, source: str, target: str, font_size: int = 12):
-    result = BytesIO()
-    file_bytes_io.seek(0) # Ensure pointer is at the beginning
+# Response media type per target format
+MEDIA_TYPES = {
+    "pdf": "application/pdf",
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "txt": "text/plain",
+    "csv": "text/csv",
+    "xls": "application/vnd.ms-excel",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "parquet": "application/vnd.apache.parquet",
+    "feather": "application/vnd.apache.arrow.file",
+    "zip": "application/zip",
+}
 
-    unique_id = os.urandom(8).hex()
-    temp_input_path = f"temp_input_{unique_id}.{source}"
-    temp_output_path = f"temp_output_{unique_id}.{target}"
+def output_format(to_format, output):
+    # A multi-sheet workbook converted to a one-table format comes back as a ZIP with a file per sheet
+    return "zip" if is_sheet_archive(output, to_format) else to_format
 
-    try:
-        if source == "pdf":
-            with open(temp_input_path, "wb") as f:
-                f.write(file_bytes_io.read())
-
-            if target == "docx":
-                cv = Converter(temp_input_path)
-                cv.convert(temp_output_path, start=0, end=None)
-                cv.close()
-                with open(temp_output_path, "rb") as f:
-                    result.write(f.read())
-            elif target == "txt":
-                with pdfplumber.open(file_bytes_io) as pdf:
-                    text = "\n".join([page.extract_text() or "" for page in pdf.pages])
-                    result.write(text.encode("utf-8"))
-
-        elif source == "docx":
-            with open(temp_input_path, "wb") as f:
-                f.write(file_bytes_io.read())
-
-            if target == "pdf":
-                pypandoc.convert_file(
-                    temp_input_path,
-                    "pdf",
-                    outputfile=temp_output_path,
-                    extra_args=['--pdf-engine=wkhtmltopdf']
-                )
-                with open(temp_output_path, "rb") as f:
-                    result.write(f.read())
-            elif target == "txt":
-                doc_bytes = BytesIO(file_bytes_io.read())
-                doc = Document(doc_bytes)
-                text = "\n".join([p.text for p in doc.paragraphs])
-                result.write(text.encode("utf-8"))
-
-        elif source == "txt":
-            text = file_bytes_io.read().decode("utf-8")
-            if target == "pdf":
-                c = canvas.Canvas(result, pagesize=letter)
-                c.setFont("Helvetica", font_size) # Apply font size from frontend
-                y = 750
-                for line in text.splitlines():
-                    c.drawString(50, y, line)
-                    y -= (font_size + 5) # Adjust line spacing based on font size
-                    if y < 50:
-                        c.showPage()
-                        c.setFont("Helvetica", font_size)
-                        y = 750
-                c.save()
-            elif target == "docx":
-                doc = Document()
-                # Apply basic styling based on Markdown-like syntax if present
-                for line in text.splitlines():
-                    if line.startswith('**') and line.endswith('**'):
-                        paragraph = doc.add_paragraph(line.strip('**'))
-                        paragraph.runs[0].bold = True
-                    elif line.startswith('*') and line.endswith('*'):
-                        paragraph = doc.add_paragraph(line.strip('*'))
-                        paragraph.runs[0].italic = True
-                    else:
-                        doc.add_paragraph(line)
-                doc.save(result)
+def convert_file_backend(file_bytes_io, source: str, target: str, output=None, **options):
+    """Convert in this process along the planned route; used by the benchmarks.
 
+    file_bytes_io may be a BytesIO or a path to the input on disk; the result is
+    written to output (any writable binary file object) when one is given.
+    ``options`` are converter options such as font_size, start_page and end_page.
+    """
+    route, _ = plan_route(source, target)
+    result = output if output is not None else BytesIO()
+    try:
+        run_route(file_bytes_io, route, result, **options)
+    except PageRangeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Conversion failed: {e}")
-    finally:
-        if os.path.exists(temp_input_path):
-            os.remove(temp_input_path)
-        if os.path.exists(temp_output_path):
-            os.remove(temp_output_path)
-
     result.seek(0)
     return result
 
-# Function for spreadsheet (CSV, XLS, XLSX) conversions - Reused from Streamlit app
-def convert_sheet_file_backend(file_bytes_io: BytesIO, source: str, target: str):
-    result = BytesIO()
-    file_bytes_io.seek(0)
+def pool_for(route):
+    # A route with a pandoc step runs entirely on the warm DOCX→PDF workers
+    if any(converter.pool == "docx_pdf" for converter in route):
+        return docx_pdf_pool
+    return conversion_pool
 
-    if source == "csv":
-        df = pd.read_csv(file_bytes_io)
-    else:
-        df = pd.read_excel(file_bytes_io)
+async def run_conversion(func, *args, pool=conversion_pool, wait=False, **kwargs):
+    # Dispatch a converter to a process pool, mapping worker failures to HTTP errors.
+    # Without ``wait`` a busy bounded pool turns the request away instead of queueing it.
+    try:
+        return await pool.run(func, *args, wait=wait, **kwargs)
+    except PoolBusy as e:
+        raise HTTPException(status_code=503, detail=e.detail, headers={"Retry-After": f"{e.retry_after:g}"})
+    except ConversionTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except ConversionError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
 
-    if target == "csv":
-        df.to_csv(result, index=False)
-    else:
-        df.to_excel(result, index=False, engine="openpyxl")
+def plan_route(from_format, to_format):
+    # The cheapest chain of registered converters for a pair, and the response media type
+    try:
+        route = CONVERTERS.plan(from_format, to_format)
+    except NoRoute as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return route, MEDIA_TYPES.get(to_format, "application/octet-stream")
 
-    result.seek(0)
-    return result
+def page_options(from_format, start_page=None, end_page=None):
+    # Page ranges (1-based, inclusive) only apply to PDF input; omitted bounds are left out
+    # so they don't change cache keys
+    if from_format != "pdf":
+        return {}
+    if (start_page is not None and start_page < 1) or (end_page is not None and end_page < (start_page or 1)):
+        raise HTTPException(status_code=400, detail="Invalid page range.")
+    options = {"start_page": start_page, "end_page": end_page}
+    return {name: value for name, value in options.items() if value is not None}
+
+async def convert_cached(source, content_hash, from_format, to_format, font_size, output_path, timings,
+                         wait=False, **options):
+    """Convert ``source`` (a path or buffer) into ``output_path`` through the process pool.
+
+    Returns an open cache entry instead, without converting, when the same input was
+    converted before with the same parameters; otherwise returns None. Stages, sizes and
+    the cache outcome are recorded in ``timings`` (see metrics.track_conversion).
+    ``options`` are extra converter keyword arguments, see page_options(). With ``wait``
+    the conversion queues for a busy pool instead of failing with 503.
+    """
+    route, _ = plan_route(from_format, to_format)
+
+    # Serve repeated conversions of the same bytes straight from the cache
+    cache_key = make_cache_key(content_hash, from_format, to_format, font_size=font_size, **options)
+    with timings.stage("cache"):
+        cached_output = await asyncio.to_thread(result_cache.open, cache_key)
+    if cached_output is not None:
+        timings.cache = "hit"
+        timings.output_bytes = cached_output.seek(0, os.SEEK_END)
+        cached_output.seek(0)
+        return cached_output
+    profile_path = metrics.new_profile_path(from_format, to_format) if timings.profile else None
+    try:
+        # "pool" spans the round trip; the worker reports its own stages inside it
+        with timings.stage("pool"):
+            timings.output_bytes, worker_stages, hops = await run_conversion(
+                convert_into_file, run_route, source, output_path, route, pool=pool_for(route), wait=wait,
+                profile_path=profile_path, font_size=font_size, **options
+            )
+        timings.merge(worker_stages)
+        for name, seconds, input_bytes in hops:
+            CONVERTERS.record(name, seconds, input_bytes)
+        if profile_path is not None:
+            timings.profiles.append(os.path.basename(profile_path))
+        with timings.stage("cache"):
+            await asyncio.to_thread(result_cache.put_file, cache_key, output_path)
+    except BaseException:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+    return None
+
+async def convert_upload(file, from_format, to_format, font_size=12, wait=False, **options):
+    """Convert one UploadFile and return a readable file object with the result.
+
+    With ``wait`` it queues for a busy pool instead of failing with 503 (see convert_cached).
+    """
+    plan_route(from_format, to_format)
+
+    with metrics.track_conversion(from_format, to_format) as timings:
+        # Stream the upload in, spilling large files to disk and hashing as we go
+        with timings.stage("read"):
+            upload = await spool_upload(file, suffix=from_format)
+        timings.input_bytes = upload.size
+        output_path = new_spool_path(to_format, size_hint=upload.size)
+        try:
+            converted_output = await convert_cached(upload.source(), upload.sha256, from_format, to_format,
+                                                    font_size, output_path, timings, wait=wait, **options)
+        finally:
+            upload.cleanup()
+    if converted_output is not None:
+        os.remove(output_path)
+        return converted_output
+    return open_and_unlink(output_path)
+
+async def convert_job_file(input_path, output_path, from_format, to_format, font_size, sha256, **options):
+    # Job worker callback: like convert_upload, but the output stays in the job directory
+    with metrics.track_conversion(from_format, to_format) as timings:
+        timings.input_bytes = os.path.getsize(input_path)
+        # Jobs are throttled by the job queue, so they wait for a worker rather than fail
+        cached_output = await convert_cached(input_path, sha256, from_format, to_format, font_size, output_path,
+                                             timings, wait=True, **options)
+        if cached_output is not None:
+            def copy_cached():
+                with cached_output, open(output_path, "wb") as f:
+                    shutil.copyfileobj(cached_output, f)
+            with timings.stage("temp_io"):
+                await asyncio.to_thread(copy_cached)
 
 @app.post("/convert")
 async def convert_file_endpoint(
     file: UploadFile = File(...),
     from_format: str = Form(...),
     to_format: str = Form(...),
-    font_size: int = Form(12) # Receive font size from frontend
+    font_size: int = Form(12), # Receive font size from frontend
+    start_page: Optional[int] = Form(None), # Optional PDF page range, 1-based and inclusive
+    end_page: Optional[int] = Form(None),
+    destination: Optional[str] = Form(None), # "dropbox" or "gdrive": upload the result from here instead
+    destination_folder: Optional[str] = Form(None)
+):
+    _, media_type = plan_route(from_format, to_format)
+    options = page_options(from_format, start_page, end_page)
+    export = await export_options(destination, destination_folder)
+    if export:
+        return await queue_job([file], from_format, to_format, font_size, options, export)
+    converted_output = await convert_upload(file, from_format, to_format, font_size, **options)
+    extension = output_format(to_format, converted_output)
+    return StreamingResponse(metrics.timed_stream(iter_chunks(converted_output), from_format, to_format),
+                             media_type=MEDIA_TYPES.get(extension, media_type),
+                             headers={"Content-Disposition": f"attachment; filename=converted.{extension}"})
+
+def _batch_output_name(filename, to_format, used_names):
+    # Output name inside the batch ZIP: original stem + new extension, de-duplicated
+    stem = os.path.splitext(os.path.basename(filename or ""))[0] or "converted"
+    name = f"{stem}.{to_format}"
+    counter = 1
+    while name in used_names:
+        counter += 1
+        name = f"{stem}_{counter}.{to_format}"
+    used_names.add(name)
+    return name
+
+@app.post("/convert/batch")
+async def convert_batch_endpoint(
+    files: List[UploadFile] = File(...),
+    from_format: str = Form(...),
+    to_format: str = Form(...),
+    font_size: int = Form(12),
+    start_page: Optional[int] = Form(None),
+    end_page: Optional[int] = Form(None),
+    destination: Optional[str] = Form(None),
+    destination_folder: Optional[str] = Form(None)
 ):
-    # Read the uploaded file content into BytesIO
-    file_content = await file.read()
-    file_bytes_io = BytesIO(file_content)
-
-    if from_format in doc_types and to_format in doc_types:
-        converted_output = convert_doc_file_backend(file_bytes_io, from_format, to_format, font_size)
-        media_type = f"application/{to_format}" if to_format != "txt" else "text/plain"
-    elif from_format in sheet_types and to_format in sheet_types:
-        converted_output = convert_sheet_file_backend(file_bytes_io, from_format, to_format)
-        media_type = f"application/vnd.openxmlformats-officedocument.spreadsheetml.sheet" if to_format == "xlsx" else f"text/{to_format}"
-    else:
-        raise HTTPException(status_code=400, detail="Cross-type conversions (e.g., DOCX to CSV) are not supported.")
-
-    return StreamingResponse(converted_output, media_type=media_type, 
-                             headers={"Content-Disposition": f"attachment; filename=converted.{to_format}"})
+    """Convert many files concurrently and stream back a ZIP with a manifest.json.
+
+    A file that fails to convert gets an "error" entry in the manifest instead of
+    failing the whole batch. With a ``destination`` the files are queued as a job
+    and uploaded from the backend instead.
+    """
+    plan_route(from_format, to_format) # Reject unsupported pairs up front
+    options = page_options(from_format, start_page, end_page)
+    export = await export_options(destination, destination_folder)
+    if export:
+        return await queue_job(files, from_format, to_format, font_size, options, export)
+
+    # The batch was admitted as a whole: its files wait for a worker rather than fail one by one
+    results = await asyncio.gather(
+        *(convert_upload(file, from_format, to_format, font_size, wait=True, **options) for file in files),
+        return_exceptions=True
+    )
+
+    outputs = []
+    for file, result in zip(files, results):
+        if isinstance(result, HTTPException):
+            outputs.append((file.filename, result.detail))
+        elif isinstance(result, Exception):
+            outputs.append((file.filename, f"Conversion failed: {result}"))
+        else:
+            outputs.append((file.filename, result))
+    return zip_response(from_format, to_format, outputs)
+
+def zip_response(from_format, to_format, outputs):
+    """Stream a ZIP of converted files plus a manifest.json with one status entry per file.
+
+    ``outputs`` is a list of (original filename, readable file object or error detail).
+    """
+    manifest = {"from_format": from_format, "to_format": to_format, "files": []}
+    entries = []
+    used_names = {"manifest.json"}
+    for index, (filename, result) in enumerate(outputs):
+        entry = {"index": index, "filename": filename}
+        if isinstance(result, str):
+            entry.update(status="error", detail=result)
+        else:
+            entry.update(status="ok", output=_batch_output_name(filename, output_format(to_format, result), used_names))
+            entries.append((entry["output"], result))
+        manifest["files"].append(entry)
+    entries.insert(0, ("manifest.json", json.dumps(manifest, indent=2).encode("utf-8")))
+
+    return StreamingResponse(iter_zip(entries), media_type="application/zip",
+                             headers={"Content-Disposition": "attachment; filename=converted.zip"})
+
+@app.post("/jobs", status_code=202)
+async def create_job_endpoint(
+    files: List[UploadFile] = File(...),
+    from_format: str = Form(...),
+    to_format: str = Form(...),
+    font_size: int = Form(12),
+    start_page: Optional[int] = Form(None),
+    end_page: Optional[int] = Form(None),
+    destination: Optional[str] = Form(None),
+    destination_folder: Optional[str] = Form(None)
+):
+    """Queue one or more files for conversion and return the job id straight away."""
+    plan_route(from_format, to_format) # Reject unsupported pairs up front
+    options = page_options(from_format, start_page, end_page)
+    return await queue_job(files, from_format, to_format, font_size, options,
+                           await export_options(destination, destination_folder))
+
+async def export_options(destination=None, destination_folder=None):
+    # Cloud export settings stored with a job; credentials stay in the server's environment.
+    # Checking Google Drive may read token.json, refresh it and build the service: off the loop
+    if not destination:
+        return None
+    try:
+        await asyncio.to_thread(check_destination, destination, destination_folder)
+    except ExportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"destination": destination, "folder": destination_folder}
+
+async def queue_job(files, from_format, to_format, font_size, options, export=None):
+    job_id = job_queue.create_job_dir()
+    job_files = []
+    used_names = set()
+    try:
+        for file in files:
+            # Inputs are stored in the job directory so the job survives a restart
+            upload = await spool_upload(file, threshold=-1, suffix=from_format, directory=job_queue.job_dir(job_id))
+            job_files.append({"filename": file.filename, "input": upload.path, "sha256": upload.sha256,
+                              "output_name": _batch_output_name(file.filename, to_format, used_names)})
+    except BaseException:
+        shutil.rmtree(job_queue.job_dir(job_id), ignore_errors=True)
+        raise
+    job_queue.enqueue(job_id, from_format, to_format, font_size, job_files, options, export)
+    return JSONResponse({"job_id": job_id, "status": "queued"}, status_code=202)
+
+async def export_job_file(output_path, name, export):
+    # Job worker callback: streams a converted file from the job directory to cloud storage
+    stem, extension = os.path.splitext(name)
+    if is_sheet_archive(output_path, extension.lstrip(".")):
+        name = f"{stem}.zip"
+    return await asyncio.to_thread(export_file, export["destination"], output_path, name, export.get("folder"))
+
+async def _get_job_or_404(job_id):
+    job = await asyncio.to_thread(job_queue.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
+
+@app.get("/jobs/{job_id}")
+async def job_status_endpoint(job_id: str):
+    job = await _get_job_or_404(job_id)
+    finished = sum(1 for f in job["files"] if f["status"] in ("done", "failed"))
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "from_format": job["from_format"],
+        "to_format": job["to_format"],
+        "progress": {"completed": finished, "total": len(job["files"])},
+        "destination": job["export"]["destination"] if job["export"] else None,
+        "files": [
+            {"index": f["index"], "filename": f["filename"], "status": f["status"], "detail": f["detail"],
+             "export": f.get("export")}
+            for f in job["files"]
+        ],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }
+
+@app.get("/jobs/{job_id}/result")
+async def job_result_endpoint(job_id: str):
+    """Download a finished job: the converted file, or a ZIP with a manifest for multi-file jobs."""
+    job = await _get_job_or_404(job_id)
+    if job["status"] == "failed":
+        raise HTTPException(status_code=422, detail=job["error"])
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Job is still {job['status']}.")
+
+    to_format = job["to_format"]
+    if len(job["files"]) == 1:
+        output = job["files"][0]["output"]
+        extension = output_format(to_format, output)
+        media_type = MEDIA_TYPES.get(extension, "application/octet-stream")
+        return StreamingResponse(iter_chunks(open(output, "rb")), media_type=media_type,
+                                 headers={"Content-Disposition": f"attachment; filename=converted.{extension}"})
+    outputs = [
+        (f["filename"], open(f["output"], "rb") if f["status"] == "done" else f["detail"])
+        for f in job["files"]
+    ]
+    return zip_response(job["from_format"], to_format, outputs)
+
+@app.get("/cache/stats")
+async def cache_stats_endpoint():
+    # Hit/miss/eviction counters and tier sizes, for sizing the cache
+    return result_cache.snapshot()
+
+@app.get("/converters")
+async def converters_endpoint(from_format: Optional[str] = None, to_format: Optional[str] = None):
+    """Registered converters with their measured costs; with both formats, also the route chosen now."""
+    response = {"formats": CONVERTERS.formats(), "converters": CONVERTERS.snapshot()}
+    if from_format and to_format:
+        route, _ = plan_route(from_format, to_format)
+        response["route"] = {"path": describe(route), "converters": [converter.name for converter in route]}
+    return response
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    # Prometheus scrape target: latency histograms, byte and error counts per conversion pair
+    return PlainTextResponse(metrics.render(result_cache.snapshot()),
+                             media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# Durable queue for long-running conversions, processed in the background via the pool
+job_queue = JobQueue(convert_job_file, export_file=export_job_file)
 
 # To run this FastAPI app locally:
 # Save this file as api.py
@@ -0,0 +1,93 @@
+import csv
+import io
+import random
+
+from docx import Document
+from openpyxl import Workbook
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+
+# Synthetic input sizes: (pdf pages, docx paragraphs, sheet rows, txt lines)
+SIZES = {
+    "small": {"pages": 5, "paragraphs": 50, "rows": 1_000, "lines": 1_000},
+    "medium": {"pages": 50, "paragraphs": 1_000, "rows": 100_000, "lines": 50_000},
+    "large": {"pages": 300, "paragraphs": 10_000, "rows": 1_000_000, "lines": 1_000_000},
+}
+
+_WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor "
+          "incididunt ut labore et dolore magna aliqua request handled worker status").split()
+
+
+def _sentence(rng, min_words=6, max_words=24):
+    return " ".join(rng.choice(_WORDS) for _ in range(rng.randint(min_words, max_words)))
+
+
+def make_txt(lines, seed=0):
+    rng = random.Random(seed)
+    return "\n".join(_sentence(rng, 3, 30) for _ in range(lines)).encode("utf-8")
+
+
+def make_pdf(pages, seed=0):
+    rng = random.Random(seed)
+    buffer = io.BytesIO()
+    c = canvas.Canvas(buffer, pagesize=letter)
+    for _ in range(pages):
+        text = c.beginText(50, 750)
+        text.setFont("Helvetica", 10)
+        for _ in range(55):
+            text.textLine(_sentence(rng, 6, 14))
+        c.drawText(text)
+        c.showPage()
+    c.save()
+    return buffer.getvalue()
+
+
+def make_docx(paragraphs, seed=0):
+    rng = random.Random(seed)
+    doc = Document()
+    for i in range(paragraphs):
+        if i % 20 == 0:
+            doc.add_heading(_sentence(rng, 2, 6), level=2)
+        doc.add_paragraph(_sentence(rng, 10, 60))
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+def _sheet_rows(rows, seed):
+    rng = random.Random(seed)
+    yield ["id", "name", "amount", "quantity", "active"]
+    for i in range(rows):
+        yield [i, rng.choice(_WORDS), round(rng.uniform(0, 10_000), 2), rng.randint(0, 500), rng.random() < 0.5]
+
+
+def make_csv(rows, seed=0):
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerows(_sheet_rows(rows, seed))
+    return buffer.getvalue().encode("utf-8")
+
+
+def make_xlsx(rows, seed=0):
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Sheet1")
+    for row in _sheet_rows(rows, seed):
+        ws.append(row)
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+
+def make_input(fmt, size):
+    """Synthetic input bytes for ``fmt`` ("pdf", "docx", "txt", "csv", "xlsx") at a named size."""
+    spec = SIZES[size]
+    if fmt == "pdf":
+        return make_pdf(spec["pages"])
+    if fmt == "docx":
+        return make_docx(spec["paragraphs"])
+    if fmt == "txt":
+        return make_txt(spec["lines"])
+    if fmt == "csv":
+        return make_csv(spec["rows"])
+    if fmt == "xlsx":
+        return make_xlsx(spec["rows"])
+    raise ValueError(f"No synthetic generator for {fmt!r}")
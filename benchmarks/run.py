@@ -0,0 +1,214 @@
+"""Benchmark every supported conversion pair on a synthetic corpus.
+
+Each (mode, pair, size) runs in a fresh process so peak RSS is attributable to
+that conversion alone. Modes:
+
+    backend  call convert_file_backend directly (the planned route, in-process)
+    api      POST /convert through the FastAPI app with a test client (process pool included)
+
+Usage (from the repository root):
+
+    python -m benchmarks.run --sizes small,medium --output results.json
+    python -m benchmarks.run --baseline results.json --output new.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+from benchmarks.corpus import SIZES, make_input
+
+# xls inputs need xlrd and a real legacy workbook, so xls is only benchmarked as a target
+SOURCE_FORMATS = ("pdf", "docx", "txt", "csv", "xlsx")
+CORPUS_DIR = os.path.join(tempfile.gettempdir(), "file2file_bench_corpus")
+
+
+def supported_pairs():
+    # Every pair the converter registry can route, including multi-step ones
+    from conversion.converters import CONVERTERS
+    from conversion.registry import NoRoute
+    pairs = []
+    for source in SOURCE_FORMATS:
+        for target in CONVERTERS.formats():
+            try:
+                CONVERTERS.plan(source, target)
+            except NoRoute:
+                continue
+            pairs.append((source, target))
+    return pairs
+
+
+def corpus_file(fmt, size, corpus_dir=CORPUS_DIR):
+    # Inputs are generated once and reused across runs
+    path = os.path.join(corpus_dir, f"{size}.{fmt}")
+    if not os.path.exists(path):
+        os.makedirs(corpus_dir, exist_ok=True)
+        data = make_input(fmt, size)
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(path + ".tmp", path)
+    return path
+
+
+def _peak_rss_mb(who=resource.RUSAGE_SELF):
+    return resource.getrusage(who).ru_maxrss / 1024 # ru_maxrss is in KiB on Linux
+
+
+def _run_backend(source, target, data, repeat):
+    import api
+    convert = lambda: api.convert_file_backend(BytesIO(data), source, target)
+    timings = []
+    output_bytes = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output_bytes = convert().getbuffer().nbytes
+        timings.append(time.perf_counter() - start)
+    return timings, output_bytes
+
+
+def _run_api(source, target, data, repeat):
+    from fastapi.testclient import TestClient
+    import api
+
+    form = {"from_format": source, "to_format": target}
+    timings = []
+    output_bytes = 0
+    with TestClient(api.app) as client:
+        # Warm-up: start a pool worker so process spawn time is not counted
+        client.post("/convert", files={"file": (f"warmup.{source}", data)}, data=form)
+        for _ in range(repeat):
+            start = time.perf_counter()
+            response = client.post("/convert", files={"file": (f"input.{source}", data)}, data=form)
+            timings.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                raise RuntimeError(f"HTTP {response.status_code}: {response.text[:200]}")
+            output_bytes = len(response.content)
+    return timings, output_bytes
+
+
+def _child(mode, source, target, input_path, repeat, queue):
+    result = {}
+    if mode == "api":
+        # Measure conversion work, not cache hits (must be set before api is imported)
+        os.environ["FILE2FILE_CACHE_MEMORY_MB"] = "0"
+        os.environ["FILE2FILE_CACHE_DISK_MB"] = "0"
+    try:
+        with open(input_path, "rb") as f:
+            data = f.read()
+        import api # noqa: F401  Import cost belongs to the baseline, not the conversion
+        result["baseline_rss_mb"] = _peak_rss_mb()
+        run = _run_backend if mode == "backend" else _run_api
+        timings, output_bytes = run(source, target, data, repeat)
+        result.update(
+            status="ok",
+            seconds_min=min(timings),
+            seconds_median=statistics.median(timings),
+            output_bytes=output_bytes,
+            throughput_mb_s=len(data) / 1024 / 1024 / statistics.median(timings),
+        )
+    except Exception as e:
+        result.update(status="error", error=f"{type(e).__name__}: {e}")
+    result["peak_rss_mb"] = _peak_rss_mb()
+    # Pool and page workers are waited for on shutdown, so their peak shows up here
+    result["peak_child_rss_mb"] = _peak_rss_mb(resource.RUSAGE_CHILDREN)
+    queue.put(result)
+
+
+def run_one(mode, source, target, size, repeat, timeout, corpus_dir=CORPUS_DIR):
+    input_path = corpus_file(source, size, corpus_dir)
+    record = {"mode": mode, "from_format": source, "to_format": target, "size": size,
+              "input_bytes": os.path.getsize(input_path), "repeat": repeat}
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    process = ctx.Process(target=_child, args=(mode, source, target, input_path, repeat, queue))
+    process.start()
+    try:
+        record.update(queue.get(timeout=timeout))
+    except Exception:
+        record.update(status="error", error=f"Timed out after {timeout}s")
+        process.kill()
+    process.join()
+    return record
+
+
+def _key(record):
+    return record["mode"], record["from_format"], record["to_format"], record["size"]
+
+
+def compare(results, baseline, threshold):
+    """Return (record, metric, old, new) for every metric that regressed by more than ``threshold``."""
+    previous = {_key(r): r for r in baseline["results"] if r.get("status") == "ok"}
+    regressions = []
+    for record in results:
+        old = previous.get(_key(record))
+        if old is None or record.get("status") != "ok":
+            continue
+        for metric in ("seconds_median", "peak_rss_mb", "peak_child_rss_mb"):
+            if old.get(metric) and record[metric] > old[metric] * (1 + threshold):
+                regressions.append((record, metric, old[metric], record[metric]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark File2File conversions.")
+    parser.add_argument("--sizes", default="small,medium", help=f"comma-separated, from {', '.join(SIZES)}")
+    parser.add_argument("--modes", default="backend,api", help="comma-separated: backend, api")
+    parser.add_argument("--pairs", default="", help="comma-separated from:to pairs (default: all supported)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per conversion")
+    parser.add_argument("--timeout", type=float, default=1800, help="seconds before a run is abandoned")
+    parser.add_argument("--corpus-dir", default=CORPUS_DIR)
+    parser.add_argument("--output", help="write JSON results here")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative slowdown/growth")
+    args = parser.parse_args(argv)
+
+    pairs = supported_pairs()
+    if args.pairs:
+        wanted = {tuple(p.split(":")) for p in args.pairs.split(",")}
+        pairs = [p for p in pairs if p in wanted]
+
+    results = []
+    for size in args.sizes.split(","):
+        for mode in args.modes.split(","):
+            for source, target in pairs:
+                record = run_one(mode, source, target, size, args.repeat, args.timeout, args.corpus_dir)
+                results.append(record)
+                if record["status"] == "ok":
+                    print(f"{mode:8} {size:7} {source:>5} -> {target:5} {record['seconds_median']:9.3f}s "
+                          f"{record['throughput_mb_s']:8.2f} MB/s  peak {record['peak_rss_mb']:7.1f} MB "
+                          f"(workers {record['peak_child_rss_mb']:7.1f} MB)")
+                else:
+                    print(f"{mode:8} {size:7} {source:>5} -> {target:5} ERROR {record['error']}")
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for record, metric, old, new in regressions:
+            print(f"REGRESSION {record['mode']} {record['size']} {record['from_format']} -> "
+                  f"{record['to_format']}: {metric} {old:.3f} -> {new:.3f}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
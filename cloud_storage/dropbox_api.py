@@ -1,36 +1,274 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import dropbox
-import streamlit as st
-from dropbox.exceptions import AuthError, ApiError
+import requests
+from dropbox.exceptions import AuthError, ApiError, InternalServerError, RateLimitError
+from dropbox.files import CommitInfo, UploadSessionCursor, UploadSessionFinishArg, WriteMode
 
-def upload_to_dropbox(access_token, file_content_bytes, dropbox_path):
-    """
-    Uploads a file to Dropbox.
-    :param access_token: Your Dropbox access token.
-    :param file_content_bytes: The content of the file as bytes.
-    :param dropbox_path: The full path in Dropbox where the file will be saved (e.g., "/my_converted_file.pdf").
-    """
+# Uploads larger than one chunk go through an upload session, one chunk per request.
+# Must be a multiple of 4 MB for sessions that are committed in a batch.
+CHUNK_SIZE = int(os.environ.get("FILE2FILE_DROPBOX_CHUNK_MB", 8)) * 1024 * 1024
+# Attempts per request after the first one, with exponential backoff starting at RETRY_BACKOFF seconds
+MAX_RETRIES = int(os.environ.get("FILE2FILE_DROPBOX_MAX_RETRIES", 5))
+RETRY_BACKOFF = 0.5
+# Files uploaded at the same time by upload_many_to_dropbox
+PARALLEL_UPLOADS = int(os.environ.get("FILE2FILE_DROPBOX_PARALLEL_UPLOADS", 4))
+# upload_session/finish_batch accepts at most this many entries per call
+_FINISH_BATCH_LIMIT = 1000
+# Failures that are worth retrying: the request may not have reached Dropbox or was throttled
+_RETRYABLE = (InternalServerError, RateLimitError, requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+
+class DropboxUploadError(Exception):
+    """A file of a batch upload could not be committed."""
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _check_token(access_token):
     if not access_token or access_token == "YOUR_DROPBOX_TOKEN_HERE":
         raise Exception("Dropbox access token is not configured. Please set it in .streamlit/secrets.toml")
 
-    try:
-        dbx = dropbox.Dropbox(access_token)
-        # Check if the token is valid
-        dbx.users_get_current_account()
-        
-        # Upload the file
-        dbx.files_upload(file_content_bytes, dropbox_path, mode=dropbox.files.WriteMode('overwrite'))
-        st.success(f"File '{dropbox_path}' uploaded to Dropbox!")
-
-    except AuthError:
-        raise Exception("Invalid Dropbox access token. Please check your token.")
-    except ApiError as err:
+
+def get_dropbox_client(access_token):
+    """A Dropbox client per access token, created once and reused (with its connection pool).
+
+    The token is not validated up front; an invalid one fails the first upload.
+    The SDK reads DROPBOX_API_HOST / DROPBOX_API_CONTENT_HOST, which can point it at
+    a local stand-in for the Dropbox API.
+    """
+    _check_token(access_token)
+    with _clients_lock:
+        client = _clients.get(access_token)
+        if client is None:
+            # Retries are done here per chunk, so the SDK's own retry loop is disabled
+            client = _clients[access_token] = dropbox.Dropbox(access_token, max_retries_on_error=0,
+                                                              max_retries_on_rate_limit=0)
+        return client
+
+
+def _forget_client(access_token):
+    with _clients_lock:
+        _clients.pop(access_token, None)
+
+
+def _with_retries(call, *args, **kwargs):
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return call(*args, **kwargs)
+        except _RETRYABLE as e:
+            if attempt == MAX_RETRIES:
+                raise
+            # Honour the server's Retry-After on rate limits; otherwise back off exponentially with jitter
+            delay = getattr(e, "backoff", None) or RETRY_BACKOFF * 2 ** attempt
+            time.sleep(delay * random.uniform(1, 1.5))
+
+
+def _content_size(content):
+    if isinstance(content, (bytes, bytearray, memoryview)):
+        return len(content)
+    return content.seek(0, os.SEEK_END)
+
+
+def _read(content, offset, size):
+    # bytes are sliced without copying; file objects are read from the requested offset
+    if isinstance(content, (bytes, bytearray, memoryview)):
+        return memoryview(content)[offset:offset + size]
+    content.seek(offset)
+    return content.read(size)
+
+
+class UploadSession:
+    """Progress of one chunked upload. Pass it back to upload_file() to resume after a failure."""
+
+    def __init__(self, size):
+        self.size = size
+        self.session_id = None
+        self.offset = 0
+
+
+def _incorrect_offset(err):
+    # The server already has data up to another offset (e.g. a retried chunk had arrived)
+    error = err.error
+    if hasattr(error, "is_lookup_failed") and error.is_lookup_failed():
+        error = error.get_lookup_failed()
+    if hasattr(error, "is_incorrect_offset") and error.is_incorrect_offset():
+        return error.get_incorrect_offset().correct_offset
+    return None
+
+
+def _send_chunks(client, content, session, chunk_size, progress, close):
+    # Everything but the final chunk; with close=True the final chunk is sent too and the
+    # session is closed, as finish_batch requires
+    while True:
+        remaining = session.size - session.offset
+        last = remaining <= chunk_size
+        if last and not close:
+            return
+        chunk = bytes(_read(content, session.offset, min(remaining, chunk_size)))
+        try:
+            if session.session_id is None:
+                result = _with_retries(client.files_upload_session_start, chunk, close=last)
+                session.session_id = result.session_id
+            else:
+                cursor = UploadSessionCursor(session.session_id, session.offset)
+                _with_retries(client.files_upload_session_append_v2, chunk, cursor, close=last)
+        except ApiError as err:
+            correct_offset = _incorrect_offset(err)
+            if correct_offset is None:
+                raise
+            session.offset = correct_offset # Resume from where Dropbox actually is
+            continue
+        session.offset += len(chunk)
+        if progress is not None:
+            progress(session.offset, session.size)
+        if last:
+            return
+
+
+def upload_file(client, content, dropbox_path, session=None, chunk_size=CHUNK_SIZE, progress=None, overwrite=True):
+    """Upload ``content`` (bytes or a seekable binary file) to ``dropbox_path``.
+
+    An existing file there is replaced, or with ``overwrite=False`` kept, the
+    upload getting a free name next to it ("name (1).ext").
+
+    Small files take a single request; larger ones are sent in ``chunk_size`` pieces
+    through an upload session, each chunk retried on its own. If the upload still
+    fails, calling again with the same ``session`` resumes it. ``progress(sent, total)``
+    is called after every chunk. Returns the FileMetadata of the uploaded file.
+    """
+    mode = WriteMode("overwrite") if overwrite else WriteMode("add")
+    size = _content_size(content)
+    if session is None and size <= chunk_size:
+        metadata = _with_retries(client.files_upload, bytes(_read(content, 0, size)), dropbox_path,
+                                 mode=mode, autorename=not overwrite)
+        if progress is not None:
+            progress(size, size)
+        return metadata
+
+    session = session or UploadSession(size)
+    commit = CommitInfo(path=dropbox_path, mode=mode, autorename=not overwrite)
+    while True:
+        _send_chunks(client, content, session, chunk_size, progress, close=False)
+        if session.session_id is None:
+            # A small file resumed with a fresh session: nothing was sent yet
+            session.session_id = _with_retries(client.files_upload_session_start, b"").session_id
+        chunk = bytes(_read(content, session.offset, session.size - session.offset))
+        cursor = UploadSessionCursor(session.session_id, session.offset)
+        try:
+            metadata = _with_retries(client.files_upload_session_finish, chunk, cursor, commit)
+        except ApiError as err:
+            correct_offset = _incorrect_offset(err)
+            if correct_offset is None:
+                raise
+            session.offset = correct_offset
+            continue
+        if progress is not None:
+            progress(session.size, session.size)
+        return metadata
+
+
+def upload_batch(client, files, chunk_size=CHUNK_SIZE, parallel=PARALLEL_UPLOADS, progress=None):
+    """Upload several files and commit them together with upload_session/finish_batch.
+
+    ``files`` is a list of (content, dropbox_path). Every file's data goes up through
+    its own closed upload session (in parallel), then one commit call per 1000 files
+    makes them all appear at once. Returns one FileMetadata or Exception per file.
+    ``progress(index, sent, total)`` reports each file's chunks.
+    """
+    sessions = [UploadSession(_content_size(content)) for content, _ in files]
+
+    def send(index):
+        report = (lambda sent, total: progress(index, sent, total)) if progress is not None else None
+        _send_chunks(client, files[index][0], sessions[index], chunk_size, report, close=True)
+
+    results = [None] * len(files)
+    with ThreadPoolExecutor(max_workers=max(1, parallel)) as executor:
+        futures = [executor.submit(send, index) for index in range(len(files))]
+    committable = []
+    for index, future in enumerate(futures):
+        try:
+            future.result()
+            committable.append(index)
+        except Exception as e:
+            results[index] = e
+
+    for start in range(0, len(committable), _FINISH_BATCH_LIMIT):
+        indexes = committable[start:start + _FINISH_BATCH_LIMIT]
+        entries = [
+            UploadSessionFinishArg(
+                cursor=UploadSessionCursor(sessions[i].session_id, sessions[i].offset),
+                commit=CommitInfo(path=files[i][1], mode=WriteMode("overwrite")),
+            )
+            for i in indexes
+        ]
+        batch = _with_retries(client.files_upload_session_finish_batch_v2, entries)
+        for i, entry in zip(indexes, batch.entries):
+            if entry.is_success():
+                results[i] = entry.get_success()
+            else:
+                results[i] = DropboxUploadError(f"Dropbox upload failed: {entry.get_failure()}")
+    return results
+
+
+def _friendly_error(err):
+    if isinstance(err, DropboxUploadError):
+        return err
+    if isinstance(err, AuthError):
+        return Exception("Invalid Dropbox access token. Please check your token.")
+    if isinstance(err, ApiError):
         # This could be due to invalid path, quota limits, etc.
-        if err.error.is_path() and err.error.get_path().is_insufficient_space():
-            raise Exception("Dropbox upload failed: Insufficient space.")
+        error = err.error
+        if hasattr(error, "is_path") and error.is_path() and error.get_path().is_insufficient_space():
+            return Exception("Dropbox upload failed: Insufficient space.")
         elif err.user_message_text:
-            raise Exception(f"Dropbox upload failed: {err.user_message_text}")
+            return Exception(f"Dropbox upload failed: {err.user_message_text}")
         else:
-            raise Exception(f"Dropbox upload failed: {err}")
-    except Exception as e:
-        raise Exception(f"An unexpected error occurred during Dropbox upload: {e}")
+            return Exception(f"Dropbox upload failed: {err}")
+    return Exception(f"An unexpected error occurred during Dropbox upload: {err}")
+
+
+def upload_to_dropbox(access_token, file_content_bytes, dropbox_path, client=None, progress=None, overwrite=True):
+    """
+    Uploads a file to Dropbox.
+    :param access_token: Your Dropbox access token.
+    :param file_content_bytes: The content of the file as bytes (or a seekable binary file).
+    :param dropbox_path: The full path in Dropbox where the file will be saved (e.g., "/my_converted_file.pdf").
+    :param client: Optional Dropbox client to use instead of the cached one for ``access_token``.
+    :param progress: Optional callback progress(bytes_sent, total_bytes).
+    :param overwrite: Replace a file already at ``dropbox_path``; otherwise the upload is renamed.
+    :return: The FileMetadata of the uploaded file.
+    """
+    if client is None:
+        client = get_dropbox_client(access_token)
+    try:
+        return upload_file(client, file_content_bytes, dropbox_path, progress=progress, overwrite=overwrite)
+    except AuthError as err:
+        _forget_client(access_token)
+        raise _friendly_error(err)
+    except Exception as err:
+        raise _friendly_error(err)
+
 
+def upload_many_to_dropbox(access_token, files, client=None, progress=None):
+    """
+    Uploads several files to Dropbox and commits them in one batch.
+    :param files: list of (file content as bytes, Dropbox path) pairs.
+    :return: list with the FileMetadata, or an Exception describing the failure, for each file.
+    """
+    if client is None:
+        client = get_dropbox_client(access_token)
+    try:
+        results = upload_batch(client, files, progress=progress)
+    except AuthError as err:
+        _forget_client(access_token)
+        raise _friendly_error(err)
+    except Exception as err:
+        raise _friendly_error(err)
+    return [_friendly_error(r) if isinstance(r, Exception) else r for r in results]
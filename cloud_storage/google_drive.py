@@ -1,84 +1,196 @@
 import os
 import io
-import streamlit as st
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import google_auth_httplib2
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from googleapiclient.http import MediaIoBaseUpload
+from googleapiclient.http import MediaIoBaseUpload, build_http
 
 # If modifying these scopes, delete the file token.json.
 SCOPES = ['https://www.googleapis.com/auth/drive.file'] # Allows app to access files it creates
+TOKEN_FILE = os.environ.get("FILE2FILE_GOOGLE_TOKEN_FILE", "token.json")
+# Alternative Drive endpoint, e.g. a local fake of the Drive API for testing. Uploads always
+# use HTTPS; point HTTPLIB2_CA_CERTS at the fake's certificate.
+DRIVE_API_ENDPOINT = os.environ.get("FILE2FILE_GOOGLE_DRIVE_ENDPOINT")
+# Bytes sent per upload request; must be a multiple of 256 KB
+CHUNK_SIZE = int(os.environ.get("FILE2FILE_GOOGLE_DRIVE_CHUNK_MB", 8)) * 1024 * 1024
+# Attempts per chunk after the first one; the client library retries 429/5xx responses and
+# connection errors with randomized exponential backoff
+MAX_RETRIES = int(os.environ.get("FILE2FILE_GOOGLE_DRIVE_MAX_RETRIES", 5))
+# Files uploaded at the same time by upload_many_to_google_drive
+PARALLEL_UPLOADS = int(os.environ.get("FILE2FILE_GOOGLE_DRIVE_PARALLEL_UPLOADS", 4))
+
+# One service per process: credentials are loaded and the API surface is built once
+_service = None
+_credentials = None # The service's credentials, shared with the per-thread connections
+_service_lock = threading.Lock()
+# httplib2 connections are not thread-safe, so every thread gets its own authorized one
+_local = threading.local()
+
+
+def _authorize_in_streamlit():
+    # Interactive OAuth flow for the Streamlit app; the backend relies on an existing token.json
+    import streamlit as st
+
+    # Check if credentials.json is uploaded via Streamlit secrets or directly
+    if 'google_credentials' in st.secrets:
+        # Use credentials from Streamlit secrets (if stored as string)
+        creds_info = json.loads(st.secrets['google_credentials'])
+        flow = InstalledAppFlow.from_client_config(creds_info, SCOPES)
+    elif os.path.exists('credentials.json'):
+        # Use credentials.json file if present in the repo
+        flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
+    else:
+        st.error("Google Drive 'credentials.json' not found. Please upload it to your Streamlit repository or configure it in Streamlit secrets.")
+        st.stop() # Stop execution if credentials are not found
+
+    # This will open a new browser tab for OAuth.
+    # In Streamlit Cloud, this flow can be tricky.
+    # For a more robust solution in production, consider a custom OAuth callback.
+    # For this example, we'll assume the user can complete the flow.
+    auth_url, _ = flow.authorization_url(prompt='consent')
+    st.markdown(f"Please authorize Google Drive access by clicking this link: [Authorize Google Drive]({auth_url})", unsafe_allow_html=True)
+
+    # Streamlit re-runs the script, so we need to wait for the user to authorize
+    # and then handle the redirect. This is a simplified flow for demonstration.
+    # In a real app, you'd need to handle the redirect URI and code exchange.
+    st.warning("After authorizing, you might need to manually copy the redirect URL and paste it back here if the automatic redirect doesn't work in Streamlit Cloud.")
+    auth_code = st.text_input("Enter the authorization code from the redirect URL (if prompted):")
+    if not auth_code:
+        st.stop() # Wait for auth code
+    flow.fetch_token(code=auth_code)
+    return flow.credentials
+
 
-def get_google_drive_service():
+def load_credentials(interactive=True):
+    """Credentials from token.json, refreshed if expired; else the interactive flow (Streamlit only)."""
     creds = None
     # The file token.json stores the user's access and refresh tokens, and is
     # created automatically when the authorization flow completes for the first
     # time.
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
+    if os.path.exists(TOKEN_FILE):
+        creds = Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
     # If there are no (valid) credentials available, let the user log in.
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
             creds.refresh(Request())
+        elif interactive:
+            creds = _authorize_in_streamlit()
         else:
-            # Check if credentials.json is uploaded via Streamlit secrets or directly
-            if 'google_credentials' in st.secrets:
-                # Use credentials from Streamlit secrets (if stored as string)
-                creds_info = json.loads(st.secrets['google_credentials'])
-                flow = InstalledAppFlow.from_client_config(creds_info, SCOPES)
-            elif os.path.exists('credentials.json'):
-                # Use credentials.json file if present in the repo
-                flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
-            else:
-                st.error("Google Drive 'credentials.json' not found. Please upload it to your Streamlit repository or configure it in Streamlit secrets.")
-                st.stop() # Stop execution if credentials are not found
-
-            # This will open a new browser tab for OAuth.
-            # In Streamlit Cloud, this flow can be tricky.
-            # For a more robust solution in production, consider a custom OAuth callback.
-            # For this example, we'll assume the user can complete the flow.
-            auth_url, _ = flow.authorization_url(prompt='consent')
-            st.markdown(f"Please authorize Google Drive access by clicking this link: [Authorize Google Drive]({auth_url})", unsafe_allow_html=True)
-            
-            # Streamlit re-runs the script, so we need to wait for the user to authorize
-            # and then handle the redirect. This is a simplified flow for demonstration.
-            # In a real app, you'd need to handle the redirect URI and code exchange.
-            st.warning("After authorizing, you might need to manually copy the redirect URL and paste it back here if the automatic redirect doesn't work in Streamlit Cloud.")
-            auth_code = st.text_input("Enter the authorization code from the redirect URL (if prompted):")
-            if auth_code:
-                flow.fetch_token(code=auth_code)
-                creds = flow.credentials
-            else:
-                st.stop() # Wait for auth code
+            raise Exception(f"Google Drive is not authorized: no valid {TOKEN_FILE} found.")
 
         # Save the credentials for the next run
-        with open('token.json', 'w') as token:
+        with open(TOKEN_FILE, 'w') as token:
             token.write(creds.to_json())
-    
-    try:
-        service = build('drive', 'v3', credentials=creds)
-        return service
-    except HttpError as error:
-        st.error(f'An error occurred: {error}')
+    return creds
+
+
+def get_google_drive_service(credentials=None, interactive=True):
+    """The process-wide Drive service, built on first use.
+
+    Its credentials refresh themselves when the access token expires, so the
+    service is never rebuilt. Pass ``credentials`` to use specific ones.
+    """
+    global _service, _credentials
+    with _service_lock:
+        if _service is None:
+            creds = credentials or load_credentials(interactive)
+            _credentials = creds
+            client_options = {"api_endpoint": DRIVE_API_ENDPOINT} if DRIVE_API_ENDPOINT else None
+            # static_discovery uses the discovery document bundled with the client: no network fetch
+            _service = build('drive', 'v3', credentials=creds, client_options=client_options,
+                             static_discovery=True, cache_discovery=False)
+        return _service
+
+
+def reset_google_drive_service():
+    # Forget the cached service, e.g. after the user re-authorized
+    global _service, _credentials
+    with _service_lock:
+        _service = _credentials = None
+    _local.__dict__.clear()
+
+
+def _thread_http(service):
+    # An authorized connection for this thread, sharing the process-wide service's
+    # (self-refreshing) credentials. Services passed in (e.g. test doubles) keep their own http.
+    with _service_lock:
+        credentials = _credentials if service is _service else None
+    if credentials is None:
         return None
+    http = getattr(_local, "http", None)
+    if http is None or http.credentials is not credentials:
+        http = _local.http = google_auth_httplib2.AuthorizedHttp(credentials, http=build_http())
+    return http
+
+
+class UploadSession:
+    """A resumable upload in progress. Pass it back to upload_file() to resume after a failure."""
+
+    def __init__(self, request, size):
+        self.request = request
+        self.size = size
+
+
+def upload_file(service, content, file_name, session=None, chunk_size=CHUNK_SIZE, progress=None,
+                mimetype='application/octet-stream'):
+    """Upload ``content`` (bytes or a seekable binary file) to Drive as ``file_name``.
 
-def upload_to_google_drive(file_content_bytes, file_name):
-    service = get_google_drive_service()
+    The file goes up through a resumable upload in ``chunk_size`` pieces; each chunk
+    is retried with backoff on transient errors by the client library.
+    If the upload still fails, calling again with the same ``session`` continues it.
+    ``progress(sent, total)`` is called after every chunk. Returns the created file's
+    metadata (id, name, webViewLink).
+    """
+    if session is None:
+        fileobj = io.BytesIO(content) if isinstance(content, (bytes, bytearray)) else content
+        media = MediaIoBaseUpload(fileobj, mimetype=mimetype, chunksize=chunk_size, resumable=True)
+        request = service.files().create(body={'name': file_name}, media_body=media,
+                                         fields='id, name, webViewLink')
+        session = UploadSession(request, media.size())
+    http = _thread_http(service)
+    response = None
+    while response is None:
+        status, response = session.request.next_chunk(http=http, num_retries=MAX_RETRIES)
+        if progress is not None:
+            sent = status.resumable_progress if status is not None else session.size
+            progress(sent, session.size)
+    return response
+
+
+def upload_to_google_drive(file_content_bytes, file_name, service=None, progress=None):
+    """Upload one file; returns its metadata (id, name, webViewLink)."""
+    service = service or get_google_drive_service()
     if not service:
         raise Exception("Google Drive service not available.")
-
-    file_metadata = {'name': file_name}
-    media = MediaIoBaseUpload(io.BytesIO(file_content_bytes),
-                              mimetype='application/octet-stream',
-                              resumable=True)
     try:
-        file = service.files().create(body=file_metadata, media_body=media,
-                                      fields='id').execute()
-        st.write(f"File ID: {file.get('id')}")
-        st.success(f"File '{file_name}' uploaded to Google Drive!")
+        return upload_file(service, file_content_bytes, file_name, progress=progress)
     except HttpError as error:
-        st.error(f'An error occurred during upload: {error}')
         raise Exception(f"Google Drive upload failed: {error}")
 
+
+def upload_many_to_google_drive(files, service=None, parallel=PARALLEL_UPLOADS, progress=None):
+    """Upload several files concurrently.
+
+    :param files: list of (file content as bytes, file name) pairs.
+    :param progress: Optional callback progress(index, bytes_sent, total_bytes).
+    :return: list with the file metadata, or an Exception describing the failure, for each file.
+    """
+    service = service or get_google_drive_service()
+
+    def upload(index):
+        content, file_name = files[index]
+        report = (lambda sent, total: progress(index, sent, total)) if progress is not None else None
+        try:
+            return upload_file(service, content, file_name, progress=report)
+        except Exception as error:
+            return Exception(f"Google Drive upload failed: {error}")
+
+    with ThreadPoolExecutor(max_workers=max(1, parallel)) as executor:
+        return list(executor.map(upload, range(len(files))))
@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+# Cache budgets (in MB) and location; a budget of 0 disables that tier
+CACHE_MEMORY_MB = int(os.environ.get("FILE2FILE_CACHE_MEMORY_MB", 256))
+CACHE_DISK_MB = int(os.environ.get("FILE2FILE_CACHE_DISK_MB", 2048))
+CACHE_DIR = os.environ.get("FILE2FILE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "file2file_cache"))
+# Bump whenever a converter's output changes, so stale disk entries are never served
+CACHE_VERSION = 3
+
+
+def make_cache_key(content_hash, from_format, to_format, **options):
+    """Build a cache key from the input's content hash and the conversion parameters."""
+    params = json.dumps({"v": CACHE_VERSION, "from": from_format, "to": to_format, **options}, sort_keys=True)
+    return hashlib.sha256(f"{content_hash}:{params}".encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """Two-tier (memory LRU + disk) cache of conversion outputs, keyed by make_cache_key()."""
+
+    def __init__(self, memory_bytes=CACHE_MEMORY_MB * 1024 * 1024,
+                 disk_bytes=CACHE_DISK_MB * 1024 * 1024, directory=CACHE_DIR):
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.directory = directory
+        # Keep single huge outputs on disk only, so one entry can't flush the memory tier
+        self.memory_entry_limit = memory_bytes // 8
+        self._memory = OrderedDict()  # key -> bytes, least recently used first
+        self._memory_size = 0
+        self._disk = OrderedDict()  # key -> file size, least recently used first
+        self._disk_size = 0
+        self._lock = threading.Lock()
+        self.stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+        }
+        if self.disk_bytes:
+            self._load_disk_index()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.bin")
+
+    def _load_disk_index(self):
+        # Pick up entries left by earlier runs, oldest access first
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".bin"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, name[:-4], st.st_size))
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_size += size
+        self._evict_disk()
+
+    def open(self, key):
+        """Return a readable binary file object for ``key``, or None on a miss.
+
+        Disk entries are streamed from their file rather than loaded into memory.
+        """
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return BytesIO(data)
+            if key in self._disk:
+                try:
+                    f = open(self._path(key), "rb")
+                    os.utime(self._path(key))
+                except FileNotFoundError:
+                    # Removed by another process sharing the directory
+                    self._disk_size -= self._disk.pop(key)
+                else:
+                    self._disk.move_to_end(key)
+                    self.stats["disk_hits"] += 1
+                    return f
+            self.stats["misses"] += 1
+            return None
+
+    def put_file(self, key, path):
+        """Store the contents of the file at ``path`` without loading large outputs into memory."""
+        size = os.path.getsize(path)
+        data = None
+        if size <= self.memory_entry_limit:
+            with open(path, "rb") as f:
+                data = f.read()
+        tmp_path = None
+        if self._wants_disk(key, size):
+            # Copied outside the lock: a large output must not block lookups meanwhile
+            def copy(f):
+                with open(path, "rb") as source:
+                    shutil.copyfileobj(source, f)
+            tmp_path = self._write_tmp(copy)
+        with self._lock:
+            if data is not None:
+                self._put_memory(key, data)
+            self._commit_disk(key, tmp_path, size)
+
+    def _put_memory(self, key, data):
+        if len(data) > self.memory_entry_limit:
+            return
+        if key in self._memory:
+            self._memory_size -= len(self._memory.pop(key))
+        self._memory[key] = data
+        self._memory_size += len(data)
+        while self._memory_size > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+            self.stats["memory_evictions"] += 1
+
+    def _wants_disk(self, key, size):
+        # Unlocked pre-check; _commit_disk() decides for real
+        return size <= self.disk_bytes and key not in self._disk
+
+    def _write_tmp(self, write):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return tmp_path
+
+    def _commit_disk(self, key, tmp_path, size):
+        # Called with the lock held. The rename is atomic, so concurrent readers never see a partial file.
+        if tmp_path is None:
+            return
+        if key in self._disk:
+            os.remove(tmp_path)
+            return
+        os.replace(tmp_path, self._path(key))
+        self._disk[key] = size
+        self._disk_size += size
+        self._evict_disk()
+
+    def _evict_disk(self):
+        while self._disk_size > self.disk_bytes:
+            key, size = self._disk.popitem(last=False)
+            self._disk_size -= size
+            self.stats["disk_evictions"] += 1
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def snapshot(self):
+        """Counters and current tier sizes, for sizing the cache."""
+        with self._lock:
+            return {
+                **self.stats,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_size,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_size,
+            }
@@ -0,0 +1,63 @@
+import os
+import posixpath
+from urllib.parse import quote
+
+from cloud_storage.dropbox_api import upload_to_dropbox
+from cloud_storage.google_drive import get_google_drive_service, upload_to_google_drive
+
+# Credentials the backend exports with; the Streamlit app never has to see the converted bytes
+DROPBOX_ACCESS_TOKEN = os.environ.get("FILE2FILE_DROPBOX_ACCESS_TOKEN", "")
+# Dropbox folder exported files go into; a request can only name a folder below it
+DROPBOX_FOLDER = os.environ.get("FILE2FILE_DROPBOX_FOLDER", "/")
+
+DESTINATIONS = ("dropbox", "gdrive")
+
+
+class ExportError(Exception):
+    """A cloud destination is unknown, not configured on this server or given a bad folder."""
+
+
+def dropbox_folder(folder=None):
+    """The Dropbox folder for ``folder``, a path relative to DROPBOX_FOLDER.
+
+    Absolute paths and ".." are rejected, so clients can't write outside DROPBOX_FOLDER.
+    """
+    folder = (folder or "").replace("\\", "/")
+    parts = [part for part in folder.split("/") if part not in ("", ".")]
+    if folder.startswith("/") or ".." in parts:
+        raise ExportError(f"Invalid destination folder {folder!r}: it must be a relative path without '..'.")
+    return posixpath.join("/", DROPBOX_FOLDER, *parts)
+
+
+def check_destination(destination, folder=None):
+    """Validate a destination (and Dropbox folder) before any work is queued for it."""
+    if destination == "dropbox":
+        dropbox_folder(folder)
+    if destination not in DESTINATIONS:
+        raise ExportError(f"Unknown destination {destination!r}; expected one of: {', '.join(DESTINATIONS)}.")
+    if destination == "dropbox" and not DROPBOX_ACCESS_TOKEN:
+        raise ExportError("Dropbox export is not configured on the server (FILE2FILE_DROPBOX_ACCESS_TOKEN).")
+    if destination == "gdrive":
+        try:
+            get_google_drive_service(interactive=False)
+        except Exception as e:
+            raise ExportError(f"Google Drive export is not configured on the server: {e}")
+
+
+def export_file(destination, path, name, folder=None):
+    """Upload the file at ``path`` as ``name`` (into ``folder`` on Dropbox); runs in a worker thread.
+
+    The file is streamed from disk in chunks by the cloud_storage upload engines.
+    Existing Dropbox files are never replaced: a clashing upload gets a new name.
+    Returns {"destination", "name", "id", "link"} describing the uploaded file.
+    """
+    with open(path, "rb") as f:
+        if destination == "dropbox":
+            dropbox_path = posixpath.join(dropbox_folder(folder), posixpath.basename(name))
+            metadata = upload_to_dropbox(DROPBOX_ACCESS_TOKEN, f, dropbox_path, overwrite=False)
+            return {"destination": destination, "name": name, "id": metadata.id,
+                    "link": f"https://www.dropbox.com/home{quote(posixpath.dirname(metadata.path_display))}"
+                            f"?preview={quote(metadata.name)}"}
+        uploaded = upload_to_google_drive(f, name, service=get_google_drive_service(interactive=False))
+        return {"destination": destination, "name": name, "id": uploaded.get("id"),
+                "link": uploaded.get("webViewLink")}
@@ -0,0 +1,141 @@
+import functools
+import os
+import shutil
+import zipfile
+
+from docx import Document
+
+from conversion import docx_pdf
+from conversion.docx_pdf import convert_docx_to_pdf
+from conversion.metrics import stage
+from conversion.pdf_pages import extract_pdf_text, convert_pdf_to_docx
+from conversion.registry import Converter, Registry
+from conversion.sheet_engines import (COLUMNAR_FORMATS, csv_to_columnar, is_sheet_archive,
+                                      read_sheets, write_sheets)
+from conversion.sheet_stream import should_stream, convert_sheet_streaming
+from conversion.text_pdf import render_text_pdf
+
+# Every conversion step the API can chain together. Initial costs are rough seconds
+# per MB of input; measured costs replace them as conversions run.
+CONVERTERS = Registry()
+
+PAGE_RANGE = ("start_page", "end_page")
+SHEET_FORMATS = ("csv", "xls", "xlsx")
+
+
+def _rewind(source):
+    # Converters accept either a file path (large, spooled uploads) or a file-like object
+    if not isinstance(source, (str, os.PathLike)):
+        source.seek(0)
+    return source
+
+
+def _read_source(source):
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            return f.read()
+    return _rewind(source).read()
+
+
+@CONVERTERS.register("pdf", "docx", options=PAGE_RANGE, cost=5.0)
+def pdf_to_docx(source, output, start_page=None, end_page=None):
+    # Large documents are split across processes by page
+    with stage("convert"):
+        convert_pdf_to_docx(_rewind(source), output, start_page, end_page)
+
+
+@CONVERTERS.register("pdf", "txt", options=PAGE_RANGE, cost=1.0, lossy=True)
+def pdf_to_txt(source, output, start_page=None, end_page=None):
+    with stage("convert"):
+        extract_pdf_text(_rewind(source), output, start_page, end_page)
+
+
+# pandoc + wkhtmltopdf, on the pre-started workers of the DOCX→PDF pool
+CONVERTERS.add(Converter("docx_to_pdf", "docx", "pdf", convert_docx_to_pdf, pool="docx_pdf", cost=2.0))
+
+
+@CONVERTERS.register("docx", "txt", cost=0.3, lossy=True)
+def docx_to_txt(source, output):
+    with stage("convert"):
+        doc = Document(_rewind(source))
+        text = "\n".join([p.text for p in doc.paragraphs])
+    with stage("serialize"):
+        output.write(text.encode("utf-8"))
+
+
+@CONVERTERS.register("txt", "pdf", options=("font_size",), cost=0.5)
+def txt_to_pdf(source, output, font_size=12):
+    # Streams the input line by line, wrapping long lines to the page width
+    with stage("convert"):
+        render_text_pdf(_rewind(source), output, font_size=font_size)
+
+
+@CONVERTERS.register("txt", "docx", cost=0.5)
+def txt_to_docx(source, output):
+    with stage("convert"):
+        text = _read_source(source).decode("utf-8")
+        doc = Document()
+        # Apply basic styling based on Markdown-like syntax if present
+        for line in text.splitlines():
+            if line.startswith('**') and line.endswith('**'):
+                paragraph = doc.add_paragraph(line.strip('**'))
+                paragraph.runs[0].bold = True
+            elif line.startswith('*') and line.endswith('*'):
+                paragraph = doc.add_paragraph(line.strip('*'))
+                paragraph.runs[0].italic = True
+            else:
+                doc.add_paragraph(line)
+    with stage("serialize"):
+        doc.save(output)
+
+
+def convert_sheet(source, output, from_format, to_format):
+    # Large inputs go through the constant-memory engine instead of full DataFrames
+    if should_stream(_rewind(source), from_format, to_format):
+        with stage("convert"):
+            convert_sheet_streaming(_rewind(source), from_format, to_format, output)
+        return
+
+    if from_format == "csv" and to_format in COLUMNAR_FORMATS:
+        with stage("convert"):
+            csv_to_columnar(_rewind(source), output, to_format)
+        return
+
+    with stage("parse"):
+        sheets = read_sheets(_rewind(source), from_format)
+
+    with stage("serialize"):
+        write_sheets(sheets, output, to_format)
+
+
+for _source in SHEET_FORMATS:
+    for _target in SHEET_FORMATS + COLUMNAR_FORMATS:
+        if _source != _target:
+            # CSV keeps neither cell types nor formatting
+            CONVERTERS.add(Converter(f"{_source}_to_{_target}", _source, _target,
+                                     functools.partial(convert_sheet, from_format=_source, to_format=_target),
+                                     cost=2.0 if _target != "csv" else 1.0, lossy=_target == "csv"))
+
+
+@CONVERTERS.register("csv", "txt", cost=0.01)
+def csv_to_txt(source, output):
+    # CSV already is plain text; this step lets spreadsheets reach the document formats
+    with stage("temp_io"):
+        if is_sheet_archive(_rewind(source), "csv"):
+            # One CSV per sheet: run them together, each under its file name
+            with zipfile.ZipFile(_rewind(source)) as archive:
+                for i, name in enumerate(archive.namelist()):
+                    header = f"{name}\n" if i == 0 else f"\n{name}\n"
+                    output.write(header.encode("utf-8"))
+                    with archive.open(name) as entry:
+                        shutil.copyfileobj(entry, output)
+        elif isinstance(source, (str, os.PathLike)):
+            with open(source, "rb") as f:
+                shutil.copyfileobj(f, output)
+        else:
+            shutil.copyfileobj(_rewind(source), output)
+
+
+def warm_up():
+    """Initializer for the DOCX→PDF pool: importing this module loads every converter."""
+    docx_pdf.warm_up()
@@ -0,0 +1,75 @@
+import os
+import shutil
+import signal
+import subprocess
+
+import pypandoc
+
+from conversion.metrics import stage
+from conversion.scratch import scratch_path, source_path
+
+# DOCX→PDF runs pandoc with wkhtmltopdf on a dedicated pool of pre-started workers
+DOCX_PDF_WORKERS = int(os.environ.get("FILE2FILE_DOCX_PDF_WORKERS", min(4, os.cpu_count() or 1)))
+# Recycle a worker after this many conversions
+DOCX_PDF_MAX_JOBS = int(os.environ.get("FILE2FILE_DOCX_PDF_MAX_JOBS", 100))
+# Requests allowed to wait for a busy worker, and for how many seconds, before getting a 503
+DOCX_PDF_QUEUE_SIZE = int(os.environ.get("FILE2FILE_DOCX_PDF_QUEUE_SIZE", 2 * DOCX_PDF_WORKERS))
+DOCX_PDF_QUEUE_TIMEOUT = float(os.environ.get("FILE2FILE_DOCX_PDF_QUEUE_TIMEOUT", 30))
+# Seconds between health checks of idle workers
+DOCX_PDF_HEALTH_INTERVAL = float(os.environ.get("FILE2FILE_DOCX_PDF_HEALTH_INTERVAL", 30))
+# Seconds one pandoc run may take before it (and wkhtmltopdf) is killed
+DOCX_PDF_TIMEOUT = float(os.environ.get("FILE2FILE_DOCX_PDF_TIMEOUT", 120))
+
+PDF_ENGINE = "wkhtmltopdf"
+
+# Tool paths, resolved once per worker process by warm_up()
+_tools = {}
+
+
+def warm_up():
+    """Pool initializer: locate pandoc and wkhtmltopdf once per worker.
+
+    pypandoc.convert_file probes pandoc for its version and lists its input and output
+    formats on every call, which costs two extra pandoc processes per conversion.
+    """
+    try:
+        _tools["pandoc"] = pypandoc.get_pandoc_path()
+        _tools["pandoc_version"] = pypandoc.get_pandoc_version()
+    except OSError:
+        _tools["pandoc"] = None # Reported by health_check(); conversions fail with a clear error
+    _tools["wkhtmltopdf"] = shutil.which(PDF_ENGINE)
+
+
+def health_check():
+    # Runs in a worker: proves it responds and reports the tools it found
+    return {"pid": os.getpid(), "pandoc": _tools.get("pandoc_version"), "wkhtmltopdf": _tools.get("wkhtmltopdf")}
+
+
+def _run_pandoc(input_path, output_path, timeout):
+    if "pandoc" not in _tools:
+        warm_up() # Called outside the pool, e.g. by the benchmarks
+    if _tools["pandoc"] is None:
+        raise OSError("pandoc is not installed on the server.")
+    args = [_tools["pandoc"], "--from=docx", "--to=pdf", input_path, f"--output={output_path}",
+            f"--pdf-engine={_tools['wkhtmltopdf'] or PDF_ENGINE}"]
+    # Own process group, so a hung wkhtmltopdf is killed together with pandoc
+    process = subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, start_new_session=True)
+    try:
+        _, stderr = process.communicate(timeout=timeout or None)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+        raise TimeoutError(f"pandoc did not finish within {timeout:g} seconds.") from None
+    if process.returncode != 0:
+        message = stderr.decode("utf-8", errors="replace").strip()
+        raise RuntimeError(message or f"pandoc exited with status {process.returncode}.")
+
+
+def convert_docx_to_pdf(source, output, timeout=DOCX_PDF_TIMEOUT):
+    """Convert DOCX ``source`` (a path or buffer) to PDF, written to the ``output`` file object."""
+    # pandoc only works on files: in-memory input and its output go through scratch space
+    with source_path(source, "docx") as input_path, scratch_path("pdf") as output_path:
+        with stage("convert"):
+            _run_pandoc(input_path, output_path, timeout)
+        with stage("temp_io"), open(output_path, "rb") as f:
+            shutil.copyfileobj(f, output)
@@ -0,0 +1,274 @@
+import asyncio
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import tempfile
+import time
+import uuid
+
+# Job storage: a SQLite database plus one directory of inputs/outputs per job
+JOBS_DIR = os.environ.get("FILE2FILE_JOBS_DIR", os.path.join(tempfile.gettempdir(), "file2file_jobs"))
+# Number of jobs processed at the same time (files inside a job are converted concurrently)
+JOB_RUNNERS = int(os.environ.get("FILE2FILE_JOB_RUNNERS", 2))
+# Finished jobs and their files are deleted after this many hours
+JOB_TTL_HOURS = float(os.environ.get("FILE2FILE_JOB_TTL_HOURS", 24))
+# Concurrent conversions allowed per type, e.g. "pdf:docx=2,docx:pdf=1"
+JOB_CONCURRENCY = os.environ.get("FILE2FILE_JOB_CONCURRENCY", "")
+JOB_DEFAULT_CONCURRENCY = int(os.environ.get("FILE2FILE_JOB_DEFAULT_CONCURRENCY", os.cpu_count() or 1))
+# A running job is taken over by another process once its owner has not renewed the
+# lease for this many seconds (it crashed or was stopped mid-job)
+JOB_LEASE_SECONDS = float(os.environ.get("FILE2FILE_JOB_LEASE_SECONDS", 60))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def parse_concurrency_limits(spec):
+    """Parse "pdf:docx=2,docx:pdf=1" into {("pdf", "docx"): 2, ("docx", "pdf"): 1}."""
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        pair, _, limit = item.partition("=")
+        source, _, target = pair.partition(":")
+        limits[(source.strip(), target.strip())] = int(limit)
+    return limits
+
+
+class JobQueue:
+    """Durable conversion job queue backed by SQLite and the filesystem.
+
+    Jobs survive restarts: queued jobs are picked up again. A running job is leased
+    to the process that claimed it, which renews the lease while it works; once the
+    lease runs out, another process takes the job over, keeping any files that had
+    already finished. Several API processes can share one jobs directory.
+    """
+
+    def __init__(self, convert_file, export_file=None, directory=JOBS_DIR, runners=JOB_RUNNERS,
+                 concurrency=JOB_CONCURRENCY, default_concurrency=JOB_DEFAULT_CONCURRENCY,
+                 ttl_hours=JOB_TTL_HOURS, lease_seconds=JOB_LEASE_SECONDS):
+        # convert_file(input_path, output_path, from_format, to_format, font_size, sha256, **options)
+        # is awaited per file; export_file(output_path, name, export) then uploads it for jobs
+        # queued with an export destination and returns a description of the upload
+        self.convert_file = convert_file
+        self.export_file = export_file
+        self.directory = directory
+        self.runners = max(1, runners)
+        self.limits = parse_concurrency_limits(concurrency)
+        self.default_concurrency = max(1, default_concurrency)
+        self.ttl_seconds = ttl_hours * 3600
+        self.lease_seconds = lease_seconds
+        # Identifies this queue's claims; unique per process start
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._semaphores = {}
+        self._wakeup = None
+        self._tasks = []
+        self._db_path = os.path.join(directory, "jobs.db")
+
+    # --- Storage ---
+
+    def _connect(self):
+        conn = sqlite3.connect(self._db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    from_format TEXT NOT NULL,
+                    to_format TEXT NOT NULL,
+                    font_size INTEGER NOT NULL,
+                    files TEXT NOT NULL,
+                    options TEXT NOT NULL DEFAULT '{}',
+                    export TEXT,
+                    owner TEXT,
+                    lease_until REAL,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+
+    def job_dir(self, job_id):
+        return os.path.join(self.directory, job_id)
+
+    def create_job_dir(self):
+        job_id = uuid.uuid4().hex
+        os.makedirs(self.job_dir(job_id))
+        return job_id
+
+    def enqueue(self, job_id, from_format, to_format, font_size, files, options=None, export=None):
+        """Queue a job whose inputs are already stored in its job directory.
+
+        ``files`` is a list of dicts with "filename", "input" (path) and "sha256", plus
+        "output_name" when exporting; ``options`` are extra converter keyword arguments
+        (e.g. a PDF page range). ``export`` (e.g. {"destination": "dropbox"}) makes every
+        converted file be uploaded to cloud storage once it is ready.
+        """
+        now = time.time()
+        records = [
+            {**f, "index": i, "status": QUEUED, "output": None, "detail": None, "export": None}
+            for i, f in enumerate(files)
+        ]
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, from_format, to_format, font_size, files, options, export,"
+                " created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, from_format, to_format, font_size, json.dumps(records),
+                 json.dumps(options or {}), json.dumps(export) if export else None, now, now),
+            )
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["files"] = json.loads(job["files"])
+        job["options"] = json.loads(job["options"])
+        job["export"] = json.loads(job["export"]) if job["export"] else None
+        return job
+
+    def _update(self, job_id, **fields):
+        # Only while this queue owns the job: one that was taken over is left to its new owner
+        if "files" in fields:
+            fields["files"] = json.dumps(fields["files"])
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ? AND owner = ?",
+                         (*fields.values(), job_id, self.owner))
+
+    def _claim_next(self):
+        # The conditional UPDATE makes claiming safe across several API processes
+        now = time.time()
+        claimable = "(status = ? OR (status = ? AND lease_until < ?))"
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT id FROM jobs WHERE {claimable} ORDER BY created_at LIMIT 10", (QUEUED, RUNNING, now)
+            ).fetchall()
+            for row in rows:
+                claimed = conn.execute(
+                    f"UPDATE jobs SET status = ?, owner = ?, lease_until = ?, updated_at = ? WHERE id = ? AND {claimable}",
+                    (RUNNING, self.owner, now + self.lease_seconds, now, row["id"], QUEUED, RUNNING, now),
+                ).rowcount
+                if claimed:
+                    return row["id"]
+        return None
+
+    def _renew_leases(self):
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET lease_until = ? WHERE owner = ? AND status = ?",
+                         (time.time() + self.lease_seconds, self.owner, RUNNING))
+
+    def purge_expired(self):
+        cutoff = time.time() - self.ttl_seconds
+        with self._connect() as conn:
+            expired = [row["id"] for row in conn.execute(
+                "SELECT id FROM jobs WHERE status IN (?, ?) AND updated_at < ?", (DONE, FAILED, cutoff)
+            )]
+            conn.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in expired])
+        for job_id in expired:
+            shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+
+    # --- Processing ---
+
+    def _semaphore(self, from_format, to_format):
+        key = (from_format, to_format)
+        if key not in self._semaphores:
+            self._semaphores[key] = asyncio.Semaphore(self.limits.get(key, self.default_concurrency))
+        return self._semaphores[key]
+
+    async def _convert_one(self, job, record):
+        output = os.path.join(self.job_dir(job["id"]), f"output_{record['index']}.{job['to_format']}")
+        async with self._semaphore(job["from_format"], job["to_format"]):
+            try:
+                await self.convert_file(record["input"], output, job["from_format"], job["to_format"],
+                                        job["font_size"], record["sha256"], **job["options"])
+            except Exception as e:
+                record.update(status=FAILED, detail=getattr(e, "detail", None) or f"Conversion failed: {e}")
+                if os.path.exists(output):
+                    os.remove(output)
+            else:
+                record["output"] = output
+        if record["output"] is not None and job["export"] and self.export_file is not None:
+            # Uploaded outside the conversion slot; an upload failure doesn't fail the
+            # conversion, it is reported per file
+            try:
+                uploaded = await self.export_file(output, record.get("output_name") or os.path.basename(output),
+                                                  job["export"])
+                record["export"] = {"status": DONE, **uploaded}
+            except Exception as e:
+                record["export"] = {"status": FAILED, "detail": str(e)}
+        if record["output"] is not None:
+            record["status"] = DONE
+        # Persist per-file progress as soon as each file finishes
+        await asyncio.to_thread(self._update, job["id"], files=job["files"])
+
+    async def _process(self, job_id):
+        job = await asyncio.to_thread(self.get, job_id)
+        pending = [record for record in job["files"] if record["status"] not in (DONE, FAILED)]
+        try:
+            await asyncio.gather(*(self._convert_one(job, record) for record in pending))
+        except asyncio.CancelledError:
+            # Shutting down: hand the job back to the queue for any process to pick up
+            self._update(job_id, status=QUEUED, lease_until=None)
+            raise
+        failed = [record for record in job["files"] if record["status"] == FAILED]
+        if len(failed) == len(job["files"]):
+            await asyncio.to_thread(self._update, job_id, status=FAILED, files=job["files"], error=failed[0]["detail"])
+        else:
+            await asyncio.to_thread(self._update, job_id, status=DONE, files=job["files"])
+
+    async def _heartbeat(self):
+        # Renew the leases of this queue's running jobs well before they run out
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                await asyncio.to_thread(self._renew_leases)
+            except sqlite3.Error:
+                pass # Retried on the next beat
+
+    async def _runner(self):
+        last_purge = 0
+        while True:
+            if time.monotonic() - last_purge > 3600:
+                await asyncio.to_thread(self.purge_expired)
+                last_purge = time.monotonic()
+            job_id = await asyncio.to_thread(self._claim_next)
+            if job_id is None:
+                self._wakeup.clear()
+                try:
+                    # Also poll, so jobs queued by another API process are noticed
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=5)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._process(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await asyncio.to_thread(self._update, job_id, status=FAILED, error=f"Job failed: {e}")
+
+    def start(self):
+        self._init_db()
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._runner()) for _ in range(self.runners)]
+        self._tasks.append(asyncio.create_task(self._heartbeat()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
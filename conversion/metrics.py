@@ -0,0 +1,315 @@
+import contextvars
+import importlib.util
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Optional per-request profiling of the converter call: "" (off), "cprofile" or "pyinstrument"
+PROFILER = os.environ.get("FILE2FILE_PROFILER", "").lower()
+# Fraction of conversions profiled when a profiler is set; a request can also opt in
+# with the X-File2File-Profile header
+PROFILE_SAMPLE_RATE = float(os.environ.get("FILE2FILE_PROFILE_SAMPLE_RATE", 0.01))
+PROFILE_DIR = os.environ.get("FILE2FILE_PROFILE_DIR", os.path.join(tempfile.gettempdir(), "file2file_profiles"))
+PROFILE_HEADER = "X-File2File-Profile"
+if PROFILER == "pyinstrument" and importlib.util.find_spec("pyinstrument") is None:
+    PROFILER = "cprofile" # pyinstrument is optional; the standard library profiler always works
+
+# Latency buckets (seconds) shared by every histogram, from cache hits to long PDF jobs
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+class Timings:
+    """Accumulated wall time per named stage of one request or one conversion."""
+
+    def __init__(self, profile=False):
+        self.stages = {}
+        # Set per request by the middleware; conversions then run under the profiler
+        self.profile = profile
+        self.profiles = []
+        # (converter name, seconds, input bytes) per conversion step, for route planning
+        self.hops = []
+        self._start = time.perf_counter()
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def merge(self, stages):
+        for name, seconds in stages.items():
+            self.add(name, seconds)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def elapsed(self):
+        return time.perf_counter() - self._start
+
+    def server_timing(self):
+        """Value for a Server-Timing header, durations in milliseconds."""
+        entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items()]
+        entries.append(f"total;dur={self.elapsed() * 1000:.1f}")
+        return ", ".join(entries)
+
+
+# Timings of the request (API process) or the conversion (worker process) being handled
+_current = contextvars.ContextVar("file2file_timings", default=None)
+
+
+def current_timings():
+    return _current.get()
+
+
+@contextmanager
+def collect(timings):
+    """Make ``timings`` the target of stage() for the duration of the block."""
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def stage(name):
+    """Time a block into the current Timings, if any (a no-op outside a request or worker call)."""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    with timings.stage(name):
+        yield
+
+
+# --- Prometheus metrics ---
+
+# Every metric defined in this process, in definition order
+REGISTRY = []
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        # Updated from the event loop and from to_thread helpers
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            lines.extend(self._render_samples())
+        return lines
+
+    def _render_samples(self):
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labels, key)} {value:g}"
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def _render_samples(self):
+        for key, (counts, total, count) in sorted(self._values.items()):
+            # Buckets are cumulative; +Inf holds every observation
+            for bound, bucket_count in [*zip(self.buckets, counts), ("+Inf", count)]:
+                le = bound if isinstance(bound, str) else f"{bound:g}"
+                yield f"{self.name}_bucket{_format_labels(self.labels, key, [('le', le)])} {bucket_count}"
+            yield f"{self.name}_sum{_format_labels(self.labels, key)} {total:g}"
+            yield f"{self.name}_count{_format_labels(self.labels, key)} {count}"
+
+
+HTTP_IN_FLIGHT = Gauge("file2file_http_requests_in_flight", "HTTP requests currently being handled.")
+CONVERSIONS_IN_FLIGHT = Gauge("file2file_conversions_in_flight", "Conversions currently running.",
+                              ("from_format", "to_format"))
+CONVERSIONS = Counter("file2file_conversions_total", "Finished conversions, by cache outcome.",
+                      ("from_format", "to_format", "cache"))
+CONVERSION_ERRORS = Counter("file2file_conversion_errors_total", "Failed conversions, by HTTP status code.",
+                            ("from_format", "to_format", "status_code"))
+CONVERSION_SECONDS = Histogram("file2file_conversion_duration_seconds",
+                               "End-to-end conversion time, from upload read to output ready.",
+                               ("from_format", "to_format"))
+STAGE_SECONDS = Histogram("file2file_stage_duration_seconds", "Time spent per conversion stage.",
+                          ("from_format", "to_format", "stage"))
+INPUT_BYTES = Counter("file2file_input_bytes_total", "Bytes of conversion input read.", ("from_format", "to_format"))
+OUTPUT_BYTES = Counter("file2file_output_bytes_total", "Bytes of conversion output produced.",
+                       ("from_format", "to_format"))
+POOL_QUEUED = Gauge("file2file_pool_queued", "Conversions waiting for a worker of a bounded pool.", ("pool",))
+POOL_REJECTED = Counter("file2file_pool_rejected_total", "Conversions turned away because a pool was busy.",
+                        ("pool",))
+POOL_RESTARTS = Counter("file2file_pool_restarts_total", "Worker pool restarts, by cause.", ("pool", "reason"))
+
+# Cache counters from ResultCache.snapshot(); the remaining fields are exported as gauges
+_CACHE_COUNTERS = ("memory_hits", "disk_hits", "misses", "memory_evictions", "disk_evictions")
+
+
+def render(cache_stats=None):
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    for name, value in (cache_stats or {}).items():
+        counter = name in _CACHE_COUNTERS
+        metric_name = f"file2file_cache_{name}" + ("_total" if counter else "")
+        lines.append(f"# HELP {metric_name} Result cache {name.replace('_', ' ')}.")
+        lines.append(f"# TYPE {metric_name} {'counter' if counter else 'gauge'}")
+        lines.append(f"{metric_name} {value:g}")
+    return "\n".join(lines) + "\n"
+
+
+class ConversionTimings(Timings):
+    """Timings of one file's conversion, plus what is needed to record it as metrics."""
+
+    def __init__(self, profile=False):
+        super().__init__(profile)
+        self.input_bytes = 0
+        self.output_bytes = 0
+        self.cache = "miss"
+
+
+@contextmanager
+def track_conversion(from_format, to_format):
+    """Record one conversion: in-flight gauge, stage and total latency, bytes and errors.
+
+    Yields a ConversionTimings the caller fills in. Its stages are also added to the
+    current request's timings, so they show up in the Server-Timing header.
+    """
+    request = current_timings()
+    timings = ConversionTimings(request.profile if request is not None else should_profile())
+    labels = {"from_format": from_format, "to_format": to_format}
+    with CONVERSIONS_IN_FLIGHT.track(**labels):
+        try:
+            yield timings
+        except Exception as e:
+            CONVERSION_ERRORS.inc(status_code=getattr(e, "status_code", 500), **labels)
+            raise
+        else:
+            CONVERSIONS.inc(cache=timings.cache, **labels)
+        finally:
+            CONVERSION_SECONDS.observe(timings.elapsed(), **labels)
+            for name, seconds in timings.stages.items():
+                STAGE_SECONDS.observe(seconds, stage=name, **labels)
+            INPUT_BYTES.inc(timings.input_bytes, **labels)
+            OUTPUT_BYTES.inc(timings.output_bytes, **labels)
+            if request is not None:
+                request.merge(timings.stages)
+                request.profiles.extend(timings.profiles)
+
+
+def timed_stream(chunks, from_format, to_format):
+    """Pass a response body through, recording how long streaming it to the client took.
+
+    This happens after the headers are sent, so it only appears in /metrics.
+    """
+    start = time.perf_counter()
+    try:
+        yield from chunks
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage="stream",
+                              from_format=from_format, to_format=to_format)
+
+
+# --- Profiling ---
+
+def should_profile(requested=False):
+    return bool(PROFILER) and (requested or random.random() < PROFILE_SAMPLE_RATE)
+
+
+def new_profile_path(from_format, to_format):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    extension = "html" if PROFILER == "pyinstrument" else "prof"
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}_{from_format}-{to_format}_{uuid.uuid4().hex[:8]}.{extension}"
+    return os.path.join(PROFILE_DIR, name)
+
+
+@contextmanager
+def profiled(path):
+    """Profile the block into ``path`` (.prof for cProfile, .html for pyinstrument); None disables."""
+    if path is None:
+        yield
+        return
+    if path.endswith(".html"):
+        from pyinstrument import Profiler
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(profiler.output_html())
+    else:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path) # Inspect with python -m pstats or snakeviz
@@ -0,0 +1,187 @@
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError: # Not on Windows: there every conversion may use all the page workers
+    fcntl = None
+
+import pdfplumber
+from pdf2docx import Converter
+
+from conversion.scratch import SCRATCH_DIR, scratch_workdir, source_path
+
+# Documents with fewer pages than this (in the selected range) are converted in-process
+PDF_PARALLEL_MIN_PAGES = int(os.environ.get("FILE2FILE_PDF_PARALLEL_MIN_PAGES", 32))
+# Page-splitting processes that all conversions on this host may run at once. Each
+# conversion reserves as many as are free, so a lone large PDF uses every idle core,
+# while under load conversions get what is left (none: pages are converted in-process)
+# instead of every conversion worker starting a full set (cpu_count² processes).
+PDF_PAGE_WORKERS = int(os.environ.get("FILE2FILE_PDF_PAGE_WORKERS", os.cpu_count() or 1))
+# One lock file per page worker, shared by every process using the same scratch directory
+_PAGE_WORKER_SLOTS = os.path.join(SCRATCH_DIR, "pdf_page_workers")
+# Smallest number of pages handed to one text-extraction worker
+PDF_MIN_PAGES_PER_SHARD = 8
+
+
+class PageRangeError(ValueError):
+    """The requested page range does not select any page of the document."""
+
+    # Reported to the client as a bad request, also from worker processes
+    status_code = 400
+
+    @property
+    def detail(self):
+        return str(self)
+
+
+def page_range(page_count, start_page=None, end_page=None):
+    """Turn 1-based inclusive ``start_page``/``end_page`` into a 0-based ``range`` of pages."""
+    start = max(1, start_page or 1)
+    end = min(page_count, end_page or page_count)
+    if start > end:
+        raise PageRangeError(f"Page range {start_page or 1}-{end_page or 'end'} selects no pages "
+                             f"(the document has {page_count}).")
+    return range(start - 1, end)
+
+
+@contextmanager
+def page_workers(wanted):
+    """Reserve up to ``wanted`` of the host's page workers; yields how many were free.
+
+    A reservation is a lock on a slot file, so it is released when the block exits,
+    or by the OS if the process dies holding it.
+    """
+    if fcntl is None:
+        yield min(wanted, PDF_PAGE_WORKERS)
+        return
+    os.makedirs(_PAGE_WORKER_SLOTS, exist_ok=True)
+    held = []
+    try:
+        for slot in range(PDF_PAGE_WORKERS):
+            if len(held) == wanted:
+                break
+            fd = os.open(os.path.join(_PAGE_WORKER_SLOTS, f"{slot}.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+            held.append(fd)
+        yield len(held)
+    finally:
+        for fd in held:
+            os.close(fd)
+
+
+def _write_pages(pdf, pages, result):
+    for i in pages:
+        page = pdf.pages[i]
+        if i != pages.start:
+            result.write(b"\n")
+        result.write((page.extract_text() or "").encode("utf-8"))
+        page.close() # Release the page's parsed objects as we go
+
+
+def _extract_text_shard(path, first, last):
+    # Worker: text of pages first..last-1 (0-based), opening only those pages
+    with pdfplumber.open(path, pages=list(range(first + 1, last + 1))) as pdf:
+        texts = []
+        for page in pdf.pages:
+            texts.append(page.extract_text() or "")
+            page.close()
+        return texts
+
+
+def _shards(pages, workers):
+    size = max(PDF_MIN_PAGES_PER_SHARD, math.ceil(len(pages) / (workers * 2)))
+    return [(first, min(first + size, pages.stop)) for first in range(pages.start, pages.stop, size)]
+
+
+def extract_pdf_text(source, result, start_page=None, end_page=None, workers=PDF_PAGE_WORKERS):
+    """Write the text of a PDF's pages to ``result`` as UTF-8, pages separated by newlines.
+
+    Large page ranges are split into contiguous shards extracted in parallel
+    processes (as many as page workers are free) and written back in page order.
+    ``source`` is a path or a BytesIO; buffers are written to a scratch file first
+    so every worker can open it.
+    """
+    with pdfplumber.open(source) as pdf:
+        pages = page_range(len(pdf.pages), start_page, end_page)
+        if workers <= 1 or len(pages) < PDF_PARALLEL_MIN_PAGES:
+            _write_pages(pdf, pages, result)
+            return result
+
+    with page_workers(min(workers, len(_shards(pages, workers)))) as free:
+        if free > 1:
+            with source_path(source, "pdf") as path:
+                shards = _shards(pages, free)
+                with ProcessPoolExecutor(max_workers=min(free, len(shards))) as executor:
+                    futures = [executor.submit(_extract_text_shard, path, first, last) for first, last in shards]
+                    # Collect in submission order, so output is in page order whatever finishes first
+                    first_page = True
+                    for future in futures:
+                        for text in future.result():
+                            if not first_page:
+                                result.write(b"\n")
+                            result.write(text.encode("utf-8"))
+                            first_page = False
+            return result
+
+    # Every page worker is taken by other conversions: extract in this process instead
+    if not isinstance(source, (str, os.PathLike)):
+        source.seek(0)
+    with pdfplumber.open(source) as pdf:
+        _write_pages(pdf, pages, result)
+    return result
+
+
+def _converter(source):
+    if isinstance(source, (str, os.PathLike)):
+        return Converter(os.path.abspath(source))
+    return Converter(stream=source.getvalue())
+
+
+def convert_pdf_to_docx(source, result, start_page=None, end_page=None, workers=PDF_PAGE_WORKERS):
+    """Convert a PDF (path or BytesIO) to DOCX, using pdf2docx's multiprocessing mode for large ranges.
+
+    Buffers are parsed in memory; only the parallel mode, whose workers reopen the
+    document by name, needs them written to a scratch file. Like extract_pdf_text,
+    it uses only the page workers that are free.
+    """
+    cv = _converter(source)
+    try:
+        pages = page_range(len(cv.fitz_doc), start_page, end_page)
+        if workers <= 1 or len(pages) < PDF_PARALLEL_MIN_PAGES:
+            cv.convert(result, start=pages.start, end=pages.stop)
+            return result
+    finally:
+        cv.close()
+
+    with page_workers(workers) as free:
+        if free <= 1:
+            # Every page worker is taken by other conversions: convert in this process instead
+            cv = _converter(source)
+            try:
+                cv.convert(result, start=pages.start, end=pages.stop)
+            finally:
+                cv.close()
+            return result
+
+        # pdf2docx's parallel mode exchanges parsed pages through pages-N.json files in the
+        # current directory; give each conversion its own directory so concurrent ones don't clash
+        with source_path(source, "pdf") as path:
+            cv = _converter(path)
+            cwd = os.getcwd()
+            try:
+                with scratch_workdir() as work_dir:
+                    os.chdir(work_dir)
+                    try:
+                        cv.convert(result, start=pages.start, end=pages.stop, multi_processing=True, cpu_count=free)
+                    finally:
+                        os.chdir(cwd)
+            finally:
+                cv.close()
+    return result
@@ -0,0 +1,294 @@
+import asyncio
+import functools
+import os
+import sys
+import time
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from conversion import metrics
+
+# Pool settings can be tuned per deployment through environment variables
+POOL_WORKERS = int(os.environ.get("FILE2FILE_POOL_WORKERS", os.cpu_count() or 1))
+# Recycle a worker after this many conversions (0 disables recycling). pdf2docx and
+# pdfplumber tend to hold on to memory, so long-lived workers slowly bloat.
+POOL_MAX_TASKS_PER_CHILD = int(os.environ.get("FILE2FILE_POOL_MAX_TASKS_PER_CHILD", 50))
+# Seconds a single conversion may take before the request gives up (0 disables)
+POOL_JOB_TIMEOUT = float(os.environ.get("FILE2FILE_JOB_TIMEOUT", 300))
+
+
+class ConversionError(Exception):
+    """A conversion failed inside a worker process.
+
+    Carries an HTTP status code and detail so the API can surface the original
+    error; HTTPException itself does not survive pickling across processes.
+    """
+
+    def __init__(self, status_code, detail):
+        super().__init__(status_code, detail)
+        self.status_code = status_code
+        self.detail = detail
+
+    def __str__(self):
+        return str(self.detail)
+
+
+class ConversionTimeout(Exception):
+    """A conversion did not finish within the configured job timeout."""
+
+
+def _call_in_worker(func, args, kwargs):
+    # Runs inside the worker process: normalise any failure into a picklable error
+    try:
+        return func(*args, **kwargs)
+    except Exception as e:
+        status_code = getattr(e, "status_code", 500)
+        detail = getattr(e, "detail", None) or f"Conversion failed: {e}"
+        raise ConversionError(status_code, detail) from None
+
+
+class ConversionPool:
+    """Runs CPU-bound conversions in worker processes, off the event loop."""
+
+    def __init__(self, workers=POOL_WORKERS, max_tasks_per_child=POOL_MAX_TASKS_PER_CHILD,
+                 timeout=POOL_JOB_TIMEOUT, initializer=None):
+        self.workers = max(1, workers)
+        self.max_tasks_per_child = max_tasks_per_child or None
+        self.timeout = timeout or None
+        # Runs once in every worker process as it starts
+        self.initializer = initializer
+        self._executor = None
+        # Executors whose workers were killed on purpose; their other jobs are retried
+        self._retired = weakref.WeakSet()
+
+    def start(self):
+        if self._executor is not None:
+            return
+        kwargs = {"max_workers": self.workers, "initializer": self.initializer}
+        # max_tasks_per_child is only available from Python 3.11 (and implies spawn)
+        if self.max_tasks_per_child and sys.version_info >= (3, 11):
+            kwargs["max_tasks_per_child"] = self.max_tasks_per_child
+        self._executor = ProcessPoolExecutor(**kwargs)
+
+    def shutdown(self, wait=True):
+        if self._executor is None:
+            return
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+        self._executor = None
+
+    def restart(self, reason):
+        """Kill the workers and start new ones.
+
+        A hung or runaway worker would never pick up a shutdown signal. Other jobs
+        running on the killed workers are resubmitted to the new ones.
+        """
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            for process in list((executor._processes or {}).values()):
+                process.kill()
+            # No cancel_futures: pending jobs must fail as BrokenProcessPool to be retried
+            executor.shutdown(wait=False)
+            self._retired.add(executor)
+        self.start()
+
+    async def run(self, func, *args, timeout=None, wait=True, **kwargs):
+        """Run ``func(*args, **kwargs)`` in a worker process and await its result.
+
+        ``func`` and its arguments must be picklable (module-level functions).
+        On timeout the workers are killed and replaced, since the one running the
+        abandoned job would otherwise stay busy with it. Requests always wait for a
+        free worker here; ``wait`` only matters for a WarmPool.
+        """
+        loop = asyncio.get_running_loop()
+        call = functools.partial(_call_in_worker, func, args, kwargs)
+        timeout = timeout if timeout is not None else self.timeout
+        while True:
+            self.start()
+            executor = self._executor
+            future = loop.run_in_executor(executor, call)
+            try:
+                return await asyncio.wait_for(future, timeout)
+            except asyncio.TimeoutError:
+                if executor is self._executor:
+                    self.restart("timeout")
+                raise ConversionTimeout(f"Conversion timed out after {timeout:g} seconds.") from None
+            except BrokenProcessPool:
+                if executor in self._retired:
+                    # Killed because of another job (a timeout or failed health check): resubmit
+                    # here rather than through run(), which for a WarmPool would take a second slot
+                    continue
+                # A worker died (e.g. OOM-killed); replace the pool so later requests still work
+                if executor is self._executor:
+                    self.shutdown(wait=False)
+                raise ConversionError(500, "Conversion failed: worker process crashed.") from None
+
+def _health_probe(health_check, hold):
+    # Runs in a worker: report which process answered. Holding the worker a moment
+    # makes every idle worker take one probe, rather than the first one taking them all.
+    started = time.monotonic()
+    result = health_check() if health_check is not None else None
+    time.sleep(max(0.0, hold - (time.monotonic() - started)))
+    return os.getpid(), result
+
+
+class PoolBusy(Exception):
+    """A bounded pool's queue is full, or a request waited too long for a worker."""
+
+    def __init__(self, detail, retry_after):
+        super().__init__(detail)
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class WarmPool(ConversionPool):
+    """A ConversionPool whose workers are started ahead of time and kept healthy.
+
+    ``initializer`` runs once in every worker (including replacements for recycled
+    ones) to do the per-process setup up front. At most ``queue_size`` requests wait
+    for a busy worker: further ones, and ones that wait longer than ``queue_timeout``
+    seconds, are rejected with PoolBusy so latency stays bounded under load. Requests
+    run with ``wait`` (batch files) don't count toward ``queue_size``, so a batch
+    never gets interactive requests rejected just by queueing.
+
+    While the pool is idle it is checked every ``health_interval`` seconds. Worker
+    processes that died are noticed without running anything. After the pool has
+    done work (and once at startup), ``health_check`` also runs once in every worker
+    process. A worker that fails, or doesn't answer within ``health_timeout``, gets
+    all workers killed and replaced, as after a crash. Probes are ordinary tasks:
+    each counts toward ``max_tasks_per_child``, so they only run after work. An idle
+    pool is not recycled by its own checks.
+    """
+
+    def __init__(self, name, workers=POOL_WORKERS, max_tasks_per_child=POOL_MAX_TASKS_PER_CHILD,
+                 timeout=POOL_JOB_TIMEOUT, initializer=None, health_check=None, queue_size=0,
+                 queue_timeout=30, health_interval=30, health_timeout=10):
+        super().__init__(workers, max_tasks_per_child, timeout, initializer)
+        self.name = name
+        self.health_check = health_check
+        self.queue_size = max(0, queue_size)
+        self.queue_timeout = queue_timeout or None
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.health = [] # Result of the last health check, one entry per worker
+        self._needs_probe = True
+        self._slots = None
+        self._waiting = 0 # Requests waiting for a worker
+        self._queued = 0 # Those of them without wait, which count toward queue_size
+        self._running = 0
+        self._monitor = None
+        self._wakeup = None
+
+    def restart(self, reason):
+        super().restart(reason)
+        self._needs_probe = True
+        metrics.POOL_RESTARTS.inc(pool=self.name, reason=reason)
+
+    def _processes(self):
+        return list((self._executor._processes or {}).values()) if self._executor is not None else []
+
+    def _dead_workers(self):
+        # Recycled workers exit cleanly (exit code 0); killed or crashed ones don't
+        return [process for process in self._processes() if process.exitcode not in (None, 0)]
+
+    async def _probe(self):
+        # One probe per worker, submitted together so every worker is started (and warmed)
+        started = len([process for process in self._processes() if process.is_alive()]) == self.workers
+        loop = asyncio.get_running_loop()
+        probe = functools.partial(_health_probe, self.health_check, min(0.25, self.health_timeout / 4))
+        probes = asyncio.gather(*(loop.run_in_executor(self._executor, probe) for _ in range(self.workers)))
+        # Abandoned on shutdown or timeout; don't log its cancellation as an unretrieved error
+        probes.add_done_callback(lambda future: future.cancelled() or future.exception())
+        answers = await asyncio.wait_for(probes, self.health_timeout)
+        self.health = [result for _, result in answers]
+        # While workers are still starting, a fast one may answer for a slow one; once all
+        # are up, a probe answered twice by one process means another one never took it
+        if started and len({pid for pid, _ in answers}) < self.workers:
+            raise RuntimeError("A worker did not answer its health check.")
+
+    async def _watch(self):
+        while True:
+            self._wakeup.clear()
+            # Busy workers are evidently alive; checks only run while the pool is idle
+            if not (self._running or self._waiting):
+                try:
+                    if self._dead_workers():
+                        self.restart("dead_worker")
+                        self._wakeup.set() # Warm the replacements straight away
+                    elif self._needs_probe:
+                        self._needs_probe = False
+                        await self._probe()
+                except asyncio.CancelledError:
+                    raise
+                except BaseException:
+                    # Probed again after the interval, so a failing check can't restart in a loop
+                    self.restart("health_check")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.health_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start_monitor(self):
+        """Start the workers and the background health checks; call from the event loop.
+
+        The first check runs immediately, so every worker is up before traffic arrives.
+        """
+        self.start()
+        self._slots = asyncio.Semaphore(self.workers)
+        self._wakeup = asyncio.Event()
+        if self._monitor is None:
+            self._monitor = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._monitor is not None:
+            self._monitor.cancel()
+            await asyncio.gather(self._monitor, return_exceptions=True)
+            self._monitor = None
+        self.shutdown()
+
+    async def _acquire(self, wait):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+        if not self._slots.locked():
+            # Taken without yielding, so a burst of requests can't all see the same free worker
+            await self._slots.acquire()
+            return
+        if not wait and self._queued >= self.queue_size:
+            metrics.POOL_REJECTED.inc(pool=self.name)
+            raise PoolBusy(f"The {self.name} converters are busy; try again shortly.", self.queue_timeout or 1)
+        queued = 0 if wait else 1
+        self._waiting += 1
+        self._queued += queued
+        try:
+            with metrics.POOL_QUEUED.track(pool=self.name):
+                await asyncio.wait_for(self._slots.acquire(), None if wait else self.queue_timeout)
+        except asyncio.TimeoutError:
+            metrics.POOL_REJECTED.inc(pool=self.name)
+            raise PoolBusy(f"No {self.name} converter became free within {self.queue_timeout:g} seconds.",
+                           self.queue_timeout) from None
+        finally:
+            self._waiting -= 1
+            self._queued -= queued
+
+    async def run(self, func, *args, timeout=None, wait=False, **kwargs):
+        """Like ConversionPool.run, once a worker is free.
+
+        With ``wait`` the request is never rejected: it waits for a worker however
+        long the queue is (for background jobs, which are rate limited on their own).
+        """
+        await self._acquire(wait)
+        self._running += 1
+        self._needs_probe = True
+        try:
+            return await super().run(func, *args, timeout=timeout, **kwargs)
+        except ConversionError:
+            if self._executor is None:
+                # A worker crashed and the pool was dropped: start and warm a new one now
+                metrics.POOL_RESTARTS.inc(pool=self.name, reason="crash")
+                self.start()
+                if self._wakeup is not None:
+                    self._wakeup.set()
+            raise
+        finally:
+            self._running -= 1
+            self._slots.release()
@@ -0,0 +1,169 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+
+from conversion.metrics import current_timings
+from conversion.scratch import scratch_path
+
+# Weight of the newest measurement in a converter's moving-average cost
+COST_SMOOTHING = float(os.environ.get("FILE2FILE_ROUTE_COST_SMOOTHING", 0.2))
+# Longest chain of converters the planner considers
+MAX_HOPS = int(os.environ.get("FILE2FILE_ROUTE_MAX_HOPS", 3))
+# Costs are per MB of input; smaller inputs count as this much, so fixed overheads
+# (process startup, library setup) are what small documents are charged for
+MIN_COST_MB = 1.0
+
+
+class NoRoute(Exception):
+    """No chain of registered converters turns one format into the other."""
+
+
+class Converter:
+    """One conversion step from ``source`` format to ``target`` format.
+
+    ``func(source, output, **options)`` reads ``source`` (a path or buffer) and writes
+    to the ``output`` file object. It must be a module-level function so routes can
+    be sent to worker processes. ``options`` names the keyword arguments it accepts
+    (e.g. font_size), ``pool`` the worker pool it runs on, and ``cost`` its estimated
+    seconds per MB of input until real measurements come in. ``lossy`` steps drop
+    content or structure (layout, formatting, other sheets), so routes avoid them.
+    """
+
+    def __init__(self, name, source, target, func, options=(), pool="default", cost=1.0, lossy=False):
+        self.name = name
+        self.source = source
+        self.target = target
+        self.func = func
+        self.options = tuple(options)
+        self.pool = pool
+        self.cost = cost
+        self.lossy = lossy
+
+    def __repr__(self):
+        return f"Converter({self.name!r}, {self.source!r} -> {self.target!r})"
+
+
+class Registry:
+    """The available converters, and a planner that chains them into routes.
+
+    Routes are the cheapest chain by measured cost: every finished conversion
+    reports its time per converter, which is folded into an exponentially
+    weighted moving average (per process).
+    """
+
+    def __init__(self, smoothing=COST_SMOOTHING, max_hops=MAX_HOPS):
+        self.smoothing = smoothing
+        self.max_hops = max_hops
+        self._converters = {}
+        self._costs = {}
+        self._measurements = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def add(self, converter):
+        if converter.name in self._converters:
+            raise ValueError(f"A converter named {converter.name!r} is already registered.")
+        self._converters[converter.name] = converter
+        self._costs[converter.name] = converter.cost
+        return converter
+
+    def register(self, source, target, name=None, options=(), pool="default", cost=1.0, lossy=False):
+        """Decorator form of add() for converter functions."""
+        def decorator(func):
+            self.add(Converter(name or func.__name__, source, target, func, options, pool, cost, lossy))
+            return func
+        return decorator
+
+    def formats(self):
+        return sorted({fmt for c in self._converters.values() for fmt in (c.source, c.target)})
+
+    def record(self, name, seconds, input_bytes):
+        # Fold one measured run into the converter's cost
+        cost = seconds / max(input_bytes / (1024 * 1024), MIN_COST_MB)
+        with self._lock:
+            if name not in self._costs:
+                return
+            if self._measurements[name]:
+                cost = self.smoothing * cost + (1 - self.smoothing) * self._costs[name]
+            self._costs[name] = cost
+            self._measurements[name] += 1
+
+    def plan(self, source, target):
+        """The cheapest chain of converters from ``source`` to ``target`` (Dijkstra).
+
+        Routes with fewer lossy steps always win, so e.g. PDF→DOCX never goes through
+        plain text just because that is faster; among those, the lowest measured cost,
+        then the fewest hops. Raises NoRoute if there is none within ``max_hops`` steps.
+        """
+        if source == target:
+            raise NoRoute(f"The file is already in {target} format.")
+        with self._lock:
+            costs = dict(self._costs)
+        by_source = defaultdict(list)
+        for converter in self._converters.values():
+            by_source[converter.source].append(converter)
+
+        tiebreak = itertools.count()
+        queue = [(0, 0.0, 0, next(tiebreak), source, ())]
+        settled = set()
+        while queue:
+            lossy, cost, hops, _, fmt, route = heapq.heappop(queue)
+            if fmt == target:
+                return route
+            if fmt in settled:
+                continue
+            settled.add(fmt)
+            if hops == self.max_hops:
+                continue
+            for converter in by_source[fmt]:
+                if converter.target not in settled:
+                    heapq.heappush(queue, (lossy + converter.lossy, cost + costs[converter.name], hops + 1,
+                                           next(tiebreak), converter.target, route + (converter,)))
+        raise NoRoute(f"Conversion from {source} to {target} is not supported.")
+
+    def snapshot(self):
+        # Converters and their current costs, for the /converters endpoint
+        with self._lock:
+            return [
+                {"name": c.name, "from_format": c.source, "to_format": c.target, "options": list(c.options),
+                 "lossy": c.lossy, "pool": c.pool, "cost": round(self._costs[c.name], 6), "measurements": self._measurements[c.name]}
+                for c in self._converters.values()
+            ]
+
+
+def describe(route):
+    return " -> ".join([route[0].source] + [converter.target for converter in route]) if route else ""
+
+
+def _size(source):
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.getsize(source)
+    return source.getbuffer().nbytes
+
+
+def run_route(source, route, output, **options):
+    """Run the converters of ``route`` one after another, writing the result to ``output``.
+
+    Intermediate results go through scratch files. Each converter only gets the
+    ``options`` it declares. The time of every hop is reported in the current
+    Timings' ``hops``, for the registry's cost model.
+    """
+    timings = current_timings()
+    current = source
+    with ExitStack() as stack:
+        for index, converter in enumerate(route):
+            kwargs = {name: value for name, value in options.items() if name in converter.options}
+            input_bytes = _size(current)
+            start = time.perf_counter()
+            if index == len(route) - 1:
+                converter.func(current, output, **kwargs)
+            else:
+                path = stack.enter_context(scratch_path(converter.target, input_bytes))
+                with open(path, "wb") as f:
+                    converter.func(current, f, **kwargs)
+                current = path
+            if timings is not None:
+                timings.hops.append((converter.name, time.perf_counter() - start, input_bytes))
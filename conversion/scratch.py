@@ -0,0 +1,135 @@
+import glob
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+# Short-lived files (spooled uploads, conversion outputs, and inputs that converters need
+# as paths) live in one shared scratch directory, on a RAM-backed tmpfs when the system has one
+_TMPFS = "/dev/shm"
+SCRATCH_DIR = os.environ.get("FILE2FILE_SCRATCH_DIR") or os.path.join(
+    _TMPFS if os.path.isdir(_TMPFS) and os.access(_TMPFS, os.W_OK) else tempfile.gettempdir(),
+    "file2file_scratch",
+)
+# Once the scratch directory holds this much, new files go to the disk fallback instead,
+# so a burst of large documents can't exhaust the memory behind tmpfs
+SCRATCH_LIMIT_MB = int(os.environ.get("FILE2FILE_SCRATCH_LIMIT_MB", 512))
+SCRATCH_FALLBACK_DIR = os.path.join(tempfile.gettempdir(), "file2file_scratch_disk")
+
+# Every scratch entry is named after the process that created it, so leftovers of
+# crashed processes can be told apart from files that are still in use
+_PREFIX = "file2file_"
+
+
+def _usage(directory):
+    total = 0
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_file(follow_symlinks=False):
+                    total += entry.stat(follow_symlinks=False).st_size
+    except FileNotFoundError:
+        pass
+    return total
+
+
+def scratch_dir(size_hint=0):
+    """Directory for a new scratch file of about ``size_hint`` bytes."""
+    if _usage(SCRATCH_DIR) + size_hint <= SCRATCH_LIMIT_MB * 1024 * 1024:
+        directory = SCRATCH_DIR
+    else:
+        directory = SCRATCH_FALLBACK_DIR
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def new_scratch_file(suffix, size_hint=0):
+    """Create an empty scratch file and return its path; the caller removes it.
+
+    If this process dies first, cleanup_scratch() removes it instead.
+    """
+    fd, path = tempfile.mkstemp(prefix=f"{_PREFIX}{os.getpid()}_", suffix=f".{suffix}",
+                                dir=scratch_dir(size_hint))
+    os.close(fd)
+    return path
+
+
+@contextmanager
+def scratch_path(suffix, size_hint=0):
+    """Path of a new, empty scratch file that is removed when the block exits."""
+    path = new_scratch_file(suffix, size_hint)
+    try:
+        yield path
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+@contextmanager
+def source_path(source, suffix):
+    """A path to ``source`` for libraries that only read files.
+
+    Paths are passed through untouched; in-memory buffers are written once to a
+    scratch file straight from their buffer, without an intermediate copy.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        yield source
+        return
+    with source.getbuffer() as buffer, scratch_path(suffix, buffer.nbytes) as path:
+        with open(path, "wb") as f:
+            f.write(buffer)
+        buffer.release() # Don't keep the BytesIO pinned while the converter runs
+        yield path
+
+
+@contextmanager
+def scratch_workdir():
+    """A private scratch directory, removed with its contents when the block exits."""
+    path = tempfile.mkdtemp(prefix=f"{_PREFIX}{os.getpid()}_", dir=scratch_dir())
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def _owner_alive(name):
+    try:
+        pid = int(name[len(_PREFIX):].split("_", 1)[0])
+    except ValueError:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass # Someone else's process; leave its files alone
+    return True
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError: # Cleaned up concurrently by another process
+        return False
+    return True
+
+
+def cleanup_scratch():
+    """Remove scratch files left behind by processes that no longer exist.
+
+    Also removes temp_input_*/temp_output_* files that older versions wrote to
+    the working directory. Safe to call while other API processes are running.
+    """
+    removed = 0
+    for directory in (SCRATCH_DIR, SCRATCH_FALLBACK_DIR):
+        for path in glob.glob(os.path.join(directory, f"{_PREFIX}*")):
+            if _owner_alive(os.path.basename(path)):
+                continue
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif not _remove(path):
+                continue
+            removed += 1
+    for path in glob.glob("temp_input_*") + glob.glob("temp_output_*"):
+        removed += _remove(path)
+    return removed
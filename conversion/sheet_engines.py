@@ -0,0 +1,249 @@
+import importlib.util
+import os
+import re
+import zipfile
+from io import BytesIO
+
+import pandas as pd
+from pandas.io.parsers.readers import STR_NA_VALUES
+
+# Parser engines. CSV: "pyarrow" (multi-threaded) or "c" (pandas' own parser). "auto" reads
+# tables with pandas, whose float rounding pyarrow can't match to the last digit, and
+# uses pyarrow for CSV→Parquet/Feather, which never goes through pandas.
+CSV_ENGINE = os.environ.get("FILE2FILE_CSV_ENGINE", "auto").lower()
+# XLS/XLSX: "calamine" (Rust, pip install python-calamine) or "openpyxl" (xlrd for .xls);
+# "auto" picks calamine when it is installed.
+EXCEL_ENGINE = os.environ.get("FILE2FILE_EXCEL_ENGINE", "auto").lower()
+
+HAS_PYARROW = importlib.util.find_spec("pyarrow") is not None
+HAS_CALAMINE = importlib.util.find_spec("python_calamine") is not None
+
+# pandas names the only sheet it writes "Sheet1"; CSV input becomes a sheet of that name
+SHEET_NAME = "Sheet1"
+COLUMNAR_FORMATS = ("parquet", "feather")
+# Formats that hold one table: a workbook with several sheets becomes a ZIP with one file per sheet
+SINGLE_TABLE_FORMATS = ("csv",) + COLUMNAR_FORMATS
+_ZIP_MAGIC = b"PK\x03\x04"
+
+
+def _rewind(source):
+    if not isinstance(source, (str, os.PathLike)):
+        source.seek(0)
+    return source
+
+
+def csv_engine(columnar=False):
+    if CSV_ENGINE == "auto":
+        return "pyarrow" if columnar and HAS_PYARROW else "c"
+    return CSV_ENGINE
+
+
+def excel_engine(source_format):
+    engine = EXCEL_ENGINE
+    if engine == "auto":
+        engine = "calamine" if HAS_CALAMINE else "openpyxl"
+    if engine == "openpyxl" and source_format == "xls":
+        return None # pandas' default for legacy workbooks (xlrd)
+    return engine
+
+
+def _csv_convert_options(**kwargs):
+    import pyarrow.csv as pa_csv
+
+    # Blank the same cells pandas does, in text columns too
+    return pa_csv.ConvertOptions(null_values=sorted(STR_NA_VALUES), strings_can_be_null=True, **kwargs)
+
+
+def _pandas_names(source):
+    # The column names pandas gives this file (e.g. "Unnamed: 0" for a blank header)
+    return [str(name) for name in pd.read_csv(_rewind(source), nrows=0).columns]
+
+
+class ArrowMismatch(Exception):
+    """pyarrow would read this CSV differently from pandas."""
+
+
+def _check_schema(schema):
+    import pyarrow as pa
+
+    for field in schema:
+        if pa.types.is_binary(field.type) or pa.types.is_large_binary(field.type):
+            raise ArrowMismatch("Not UTF-8") # pandas reports it instead of writing bytes
+
+
+def _check_values(table):
+    # Integers beyond int64 become floats in pyarrow; pandas keeps them exact
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    for name, column in zip(table.schema.names, table.columns):
+        if pa.types.is_floating(column.type):
+            largest = pc.max(pc.abs(column)).as_py()
+            if largest is not None and largest >= 2 ** 63:
+                raise ArrowMismatch(f"Column {name!r} overflows int64")
+
+
+def _temporal_as_text(schema):
+    # pyarrow parses ISO dates and times, pandas keeps them as written: read those as text
+    import pyarrow as pa
+
+    return {field.name: pa.string() for field in schema if pa.types.is_temporal(field.type)}
+
+
+def _read_csv_arrow(source):
+    # A pyarrow Table, or None where pyarrow would read the file differently from pandas
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+
+    try:
+        table = pa_csv.read_csv(_rewind(source), convert_options=_csv_convert_options())
+        _check_schema(table.schema)
+        _check_values(table)
+    except (pa.ArrowInvalid, ArrowMismatch):
+        return None # e.g. ragged rows or an empty file: let pandas decide (and report)
+    # pandas names blank and duplicate headers itself ("Unnamed: 0", "a.1")
+    names = _pandas_names(source)
+    if len(names) != table.num_columns:
+        return None
+    temporal = _temporal_as_text(table.schema)
+    if temporal:
+        table = pa_csv.read_csv(_rewind(source), convert_options=_csv_convert_options(column_types=temporal))
+    return table.rename_columns(names)
+
+
+def iter_csv_batches(source):
+    """Stream a CSV as pyarrow RecordBatches, read the way _read_csv_arrow() reads it.
+
+    Yields the schema first, then the batches. Raises ArrowMismatch (or
+    pyarrow.ArrowInvalid), possibly after some batches, where pyarrow can't match
+    pandas; callers then start over with pandas.
+    """
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+
+    reader = pa_csv.open_csv(_rewind(source), convert_options=_csv_convert_options())
+    _check_schema(reader.schema)
+    temporal = _temporal_as_text(reader.schema)
+    if temporal:
+        reader = pa_csv.open_csv(_rewind(source), convert_options=_csv_convert_options(column_types=temporal))
+    names = _pandas_names(source)
+    if len(names) != len(reader.schema):
+        raise ArrowMismatch("Header and columns differ")
+    yield pa.schema([field.with_name(name) for field, name in zip(reader.schema, names)])
+    for batch in reader:
+        _check_values(batch)
+        yield batch.rename_columns(names)
+
+
+def columnar_writer(output, schema, target_format):
+    """An incremental Parquet or Feather writer; write_table()/write_batch(), then close()."""
+    if target_format == "parquet":
+        import pyarrow.parquet as pq
+        return pq.ParquetWriter(output, schema)
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+    # Feather v2 is the Arrow IPC file format, compressed the way write_feather() does
+    compression = "lz4" if pa.Codec.is_available("lz4") else None
+    return ipc.new_file(output, schema, options=ipc.IpcWriteOptions(compression=compression))
+
+
+def read_csv(source):
+    """Read a CSV into a DataFrame with the configured engine."""
+    if csv_engine() == "pyarrow":
+        table = _read_csv_arrow(source)
+        if table is not None:
+            return table.to_pandas()
+    return pd.read_csv(_rewind(source))
+
+
+def read_sheets(source, source_format):
+    """Every sheet of a workbook (or the one table of a CSV) as {sheet name: DataFrame}."""
+    if source_format == "csv":
+        return {SHEET_NAME: read_csv(source)}
+    return pd.read_excel(_rewind(source), sheet_name=None, engine=excel_engine(source_format))
+
+
+def _to_arrow(df):
+    import pyarrow as pa
+
+    df = df.rename(columns=str)
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Columns mixing numbers and text (common in spreadsheets) are stored as text
+        for column in df.columns[df.dtypes == object]:
+            df[column] = df[column].map(lambda value: None if pd.isna(value) else str(value))
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def write_columnar(table, output, target_format):
+    """Write a pyarrow Table (or DataFrame) as Parquet or Feather."""
+    if isinstance(table, pd.DataFrame):
+        table = _to_arrow(table)
+    if target_format == "parquet":
+        import pyarrow.parquet as pq
+        pq.write_table(table, output)
+    else:
+        import pyarrow.feather as feather
+        feather.write_feather(table, output)
+
+
+def _write_table(df, output, target_format):
+    if target_format == "csv":
+        df.to_csv(output, index=False)
+    else:
+        write_columnar(df, output, target_format)
+
+
+def sheet_file_name(sheet, target_format, used_names):
+    # Name of one sheet's file inside a multi-sheet ZIP
+    stem = re.sub(r"[^\w\- .]", "_", str(sheet)).strip() or "sheet"
+    name = f"{stem}.{target_format}"
+    counter = 1
+    while name.lower() in used_names:
+        counter += 1
+        name = f"{stem}_{counter}.{target_format}"
+    used_names.add(name.lower())
+    return name
+
+
+def write_sheets(sheets, output, target_format):
+    """Write {sheet name: DataFrame} in ``target_format``.
+
+    Workbook targets keep every sheet under its name. Single-table formats get the
+    table itself when there is one sheet, otherwise a ZIP with one file per sheet.
+    """
+    if target_format in SINGLE_TABLE_FORMATS:
+        if len(sheets) == 1:
+            _write_table(next(iter(sheets.values())), output, target_format)
+            return
+        used_names = set()
+        with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as archive:
+            for sheet, df in sheets.items():
+                buffer = BytesIO()
+                _write_table(df, buffer, target_format)
+                archive.writestr(sheet_file_name(sheet, target_format, used_names), buffer.getbuffer())
+        return
+    with pd.ExcelWriter(output, engine="openpyxl") as writer:
+        for sheet, df in sheets.items():
+            df.to_excel(writer, sheet_name=sheet, index=False)
+
+
+def csv_to_columnar(source, output, target_format):
+    """CSV to Parquet/Feather straight through Arrow when pyarrow reads the file, without pandas."""
+    table = _read_csv_arrow(source) if csv_engine(columnar=True) == "pyarrow" else None
+    write_columnar(table if table is not None else pd.read_csv(_rewind(source)), output, target_format)
+
+
+def is_sheet_archive(path_or_file, target_format):
+    """Whether a single-table output is the ZIP written for a multi-sheet workbook."""
+    if target_format not in SINGLE_TABLE_FORMATS:
+        return False
+    if isinstance(path_or_file, (str, os.PathLike)):
+        with open(path_or_file, "rb") as f:
+            return f.read(4) == _ZIP_MAGIC
+    position = path_or_file.tell()
+    try:
+        return path_or_file.read(4) == _ZIP_MAGIC
+    finally:
+        path_or_file.seek(position)
@@ -0,0 +1,281 @@
+import io
+import os
+import zipfile
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+from pandas.io.parsers import TextParser
+
+from conversion.sheet_engines import (COLUMNAR_FORMATS, SHEET_NAME, ArrowMismatch, columnar_writer,
+                                      csv_engine, iter_csv_batches, sheet_file_name)
+
+# Inputs at or above either threshold are converted with the streaming engine
+STREAM_THRESHOLD_MB = int(os.environ.get("FILE2FILE_SHEET_STREAM_THRESHOLD_MB", 25))
+STREAM_ROW_THRESHOLD = int(os.environ.get("FILE2FILE_SHEET_STREAM_ROW_THRESHOLD", 200_000))
+# Rows held in memory at a time while streaming
+CHUNK_ROWS = int(os.environ.get("FILE2FILE_SHEET_CHUNK_ROWS", 50_000))
+
+
+def _input_size(source_file):
+    if isinstance(source_file, (str, os.PathLike)):
+        return os.path.getsize(source_file)
+    return source_file.getbuffer().nbytes
+
+
+def should_stream(source_file, source, target):
+    """Decide whether a CSV/XLSX conversion is large enough to use the streaming engine."""
+    if source not in ("csv", "xlsx") or target not in ("csv", "xls", "xlsx") + COLUMNAR_FORMATS:
+        return False
+    if _input_size(source_file) >= STREAM_THRESHOLD_MB * 1024 * 1024:
+        return True
+    if source == "xlsx":
+        # Read-only mode only parses the declared sheet dimensions here, not the rows
+        wb = load_workbook(_rewind(source_file), read_only=True)
+        try:
+            rows = sum(ws.max_row or 0 for ws in wb.worksheets)
+        finally:
+            wb.close()
+        return rows >= STREAM_ROW_THRESHOLD
+    return False
+
+
+def _rewind(source_file):
+    if not isinstance(source_file, (str, os.PathLike)):
+        source_file.seek(0)
+    return source_file
+
+
+def _convert_cell(cell):
+    # Same cell normalisation pandas applies when reading with openpyxl
+    if cell.value is None:
+        return ""
+    if cell.data_type == TYPE_ERROR:
+        return float("nan")
+    if cell.data_type == TYPE_NUMERIC:
+        val = int(cell.value)
+        return val if val == cell.value else float(cell.value)
+    return cell.value
+
+
+def _parse_rows(header, rows, dtype=None):
+    return TextParser([header] + rows, header=0, skip_blank_lines=False, dtype=dtype).read()
+
+
+def sheet_names(source_file, source):
+    if source == "csv":
+        return [SHEET_NAME]
+    wb = load_workbook(_rewind(source_file), read_only=True)
+    try:
+        return [ws.title for ws in wb.worksheets]
+    finally:
+        wb.close()
+
+
+def _iter_xlsx_chunks(source_file, chunk_rows, sheet, dtype=None):
+    wb = load_workbook(_rewind(source_file), read_only=True, data_only=True)
+    try:
+        ws = wb.worksheets[sheet]
+        ws.reset_dimensions()
+        header = None
+        chunk = []
+        blank_rows = []  # pandas drops trailing empty rows, so only emit these once data follows
+        emitted = False
+        for row in ws.rows:
+            values = [_convert_cell(cell) for cell in row]
+            while values and values[-1] == "":
+                values.pop()
+            if header is None:
+                if values:
+                    header = values
+                continue
+            if not values:
+                blank_rows.append(values)
+                continue
+            chunk.extend(blank_rows)
+            blank_rows = []
+            chunk.append(values)
+            if len(chunk) >= chunk_rows:
+                yield _parse_rows(header, _pad(chunk, len(header)), dtype)
+                emitted = True
+                chunk = []
+        if header is not None and (chunk or not emitted):
+            yield _parse_rows(header, _pad(chunk, len(header)), dtype)
+    finally:
+        wb.close()
+
+
+def _pad(rows, width):
+    return [row + [""] * (width - len(row)) for row in rows]
+
+
+def iter_chunks(source_file, source, chunk_rows=CHUNK_ROWS, sheet=0, dtype=None):
+    """Yield one sheet of a CSV/XLSX input as DataFrames of at most ``chunk_rows`` rows."""
+    if source == "csv":
+        yield from pd.read_csv(_rewind(source_file), chunksize=chunk_rows, dtype=dtype)
+    else:
+        yield from _iter_xlsx_chunks(source_file, chunk_rows, sheet, dtype)
+
+
+def _scan_dtypes(source_file, source, chunk_rows, sheet=0):
+    # First pass: every dtype each column gets across the chunks, None for chunks where
+    # the column is empty (parsed as float there, which says nothing about its type)
+    dtypes = {}
+    for chunk in iter_chunks(source_file, source, chunk_rows, sheet):
+        for column, values in chunk.items():
+            dtypes.setdefault(column, []).append(values.dtype if values.notna().any() else None)
+    return dtypes
+
+
+def _resolve_dtypes(dtypes, source):
+    """Find the types a whole-file read would have given columns that vary between chunks.
+
+    Chunked parsing infers types per chunk, so a column of ints with a gap in one
+    chunk comes out as int in some chunks and float in others, and one of booleans
+    as bool, float (XLSX gaps) or text. A whole-file read makes such columns float
+    ("1.0", also for XLSX booleans), object (CSV booleans with gaps), or text once
+    text is mixed in; we do the same. Returns (dtypes the columns are parsed with,
+    dtypes the parsed chunks are cast to): text is parsed again, because a boolean
+    read as 1.0 can't be turned back into the cell it came from.
+    """
+    parse, cast = {}, {}
+    for column, seen in dtypes.items():
+        if len(set(seen)) < 2:
+            continue
+        kinds = {dtype.kind for dtype in seen if dtype is not None}
+        text = any(isinstance(dtype, pd.StringDtype) for dtype in seen)
+        if source == "csv":
+            # The C parser reads a column as numbers, as booleans (object once there are gaps) or as text
+            if kinds <= {"i", "f"}:
+                cast[column] = "float64"
+            elif kinds <= {"b", "O"} and not text:
+                cast[column] = object
+            else:
+                parse[column] = "str"
+        elif kinds <= {"b", "i", "f"}:
+            # XLSX cells go through the python parser, which turns booleans into numbers when mixed
+            cast[column] = "int64" if kinds == {"b", "i"} and None not in seen else "float64"
+        elif kinds - {"M"}:
+            parse[column] = object
+    return parse, cast
+
+
+def _sheet_chunks(source_file, source, chunk_rows, sheet, dtypes=None):
+    if dtypes is None:
+        dtypes = _scan_dtypes(source_file, source, chunk_rows, sheet)
+    parse, cast = _resolve_dtypes(dtypes, source)
+    return (chunk.astype(cast) if cast else chunk
+            for chunk in iter_chunks(source_file, source, chunk_rows, sheet, parse or None))
+
+
+def _arrow_schema(dtypes, source):
+    # One Arrow type per column for every chunk. Columns whose type varies between
+    # chunks get the type of the whole-file read; mixed ones hold text, as they do
+    # when write_columnar() converts a whole sheet.
+    import pyarrow as pa
+
+    parse, cast = _resolve_dtypes(dtypes, source)
+    fields = []
+    for column, seen in dtypes.items():
+        types = [dtype for dtype in seen if dtype is not None] or [np.dtype("float64")]
+        if column in parse:
+            arrow_type = pa.string()
+        elif column in cast:
+            arrow_type = pa.bool_() if cast[column] is object else pa.from_numpy_dtype(np.dtype(cast[column]))
+        elif len(set(types)) == 1 and types[0].kind in "iufbM":
+            arrow_type = pa.Array.from_pandas(pd.Series([], dtype=types[0])).type
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(str(column), arrow_type))
+    return pa.schema(fields)
+
+
+def _write_columnar_chunks(source_file, source, target, result, chunk_rows, sheet):
+    import pyarrow as pa
+
+    dtypes = _scan_dtypes(source_file, source, chunk_rows, sheet)
+    schema = _arrow_schema(dtypes, source)
+    writer = columnar_writer(result, schema, target)
+    try:
+        for chunk in _sheet_chunks(source_file, source, chunk_rows, sheet, dtypes):
+            chunk = chunk.rename(columns=str)
+            for field in schema:
+                if pa.types.is_string(field.type):
+                    chunk[field.name] = chunk[field.name].map(lambda value: None if pd.isna(value) else str(value))
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+    finally:
+        writer.close()
+
+
+def _write_csv_columnar(source_file, target, result, chunk_rows):
+    # pyarrow's streaming reader where it reads the file like pandas, else pandas chunks
+    import pyarrow as pa
+
+    if csv_engine(columnar=True) == "pyarrow":
+        start = result.tell()
+        try:
+            batches = iter_csv_batches(source_file)
+            writer = columnar_writer(result, next(batches), target)
+            try:
+                for batch in batches:
+                    writer.write_batch(batch)
+            finally:
+                writer.close()
+            return
+        except (pa.ArrowInvalid, ArrowMismatch):
+            # Found part-way through: drop what was written and start over
+            result.seek(start)
+            result.truncate()
+    _write_columnar_chunks(source_file, "csv", target, result, chunk_rows, 0)
+
+
+def _write_csv_chunks(chunks, result):
+    for i, chunk in enumerate(chunks):
+        chunk.to_csv(result, header=(i == 0), index=False)
+
+
+def convert_sheet_streaming(source_file, source, target, result, chunk_rows=CHUNK_ROWS):
+    """Convert CSV/XLSX to CSV/XLSX/Parquet/Feather holding only one chunk of rows in memory.
+
+    Produces the same cell values as the read_sheets + write_sheets path: every sheet
+    is converted, and a workbook with several sheets becomes a ZIP with a file per sheet.
+    """
+    names = sheet_names(source_file, source)
+
+    if target in COLUMNAR_FORMATS:
+        if source == "csv":
+            _write_csv_columnar(source_file, target, result, chunk_rows)
+        elif len(names) == 1:
+            _write_columnar_chunks(source_file, source, target, result, chunk_rows, 0)
+        else:
+            used_names = set()
+            with zipfile.ZipFile(result, "w", zipfile.ZIP_DEFLATED) as archive:
+                for sheet, name in enumerate(names):
+                    with archive.open(sheet_file_name(name, target, used_names), "w") as entry:
+                        _write_columnar_chunks(source_file, source, target, entry, chunk_rows, sheet)
+        return result
+
+    if target == "csv":
+        if len(names) == 1:
+            _write_csv_chunks(_sheet_chunks(source_file, source, chunk_rows, 0), result)
+            return result
+        used_names = set()
+        with zipfile.ZipFile(result, "w", zipfile.ZIP_DEFLATED) as archive:
+            for sheet, name in enumerate(names):
+                with archive.open(sheet_file_name(name, "csv", used_names), "w") as entry, \
+                        io.TextIOWrapper(entry, encoding="utf-8", newline="") as text:
+                    _write_csv_chunks(_sheet_chunks(source_file, source, chunk_rows, sheet), text)
+        return result
+
+    # Write-only workbooks serialise rows as they are appended instead of building the sheet in memory
+    wb = Workbook(write_only=True)
+    for sheet, name in enumerate(names):
+        ws = wb.create_sheet(name)
+        for i, chunk in enumerate(_sheet_chunks(source_file, source, chunk_rows, sheet)):
+            if i == 0:
+                ws.append(list(chunk.columns))
+            for row in chunk.itertuples(index=False, name=None):
+                ws.append(["" if pd.isna(value) else value for value in row])
+    wb.save(result)
+    return result
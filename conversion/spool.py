@@ -0,0 +1,179 @@
+import asyncio
+import hashlib
+import io
+import os
+import tempfile
+import time
+import zipfile
+from io import BytesIO
+
+from conversion import metrics
+from conversion.scratch import new_scratch_file
+
+# Uploads larger than this are spooled to disk instead of being held in memory
+SPOOL_THRESHOLD_MB = int(os.environ.get("FILE2FILE_SPOOL_THRESHOLD_MB", 8))
+# Read/write granularity for uploads and streamed responses
+CHUNK_SIZE = 1024 * 1024
+
+
+class SpooledInput:
+    """An uploaded file held in memory when small, or in a spool file on disk when large."""
+
+    def __init__(self, data=None, path=None, size=0, sha256=None):
+        self.data = data
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+
+    def source(self):
+        """What to hand to a converter: the spool file path, or an in-memory buffer."""
+        if self.path is not None:
+            return self.path
+        return BytesIO(self.data)
+
+    def cleanup(self):
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+        self.path = None
+        self.data = None
+
+
+def new_spool_path(suffix, directory=None, size_hint=0):
+    # In the shared scratch space unless it belongs somewhere else (a job's directory)
+    if directory is None:
+        return new_scratch_file(suffix, size_hint)
+    fd, path = tempfile.mkstemp(prefix="file2file_", suffix=f".{suffix}", dir=directory)
+    os.close(fd)
+    return path
+
+
+async def spool_upload(upload, threshold=SPOOL_THRESHOLD_MB * 1024 * 1024, suffix="bin", directory=None):
+    """Read an UploadFile chunk by chunk, hashing as we go and spilling to disk above ``threshold``.
+
+    A negative ``threshold`` always spools to a file (in ``directory`` when given).
+    """
+    # The multipart parser has already received the whole upload, so its size is known
+    size_hint = getattr(upload, "size", None) or 0
+    digest = hashlib.sha256()
+    chunks = []
+    size = 0
+    spool_file = None
+    path = None
+    if threshold < 0:
+        path = new_spool_path(suffix, directory, size_hint)
+        spool_file = open(path, "wb")
+    try:
+        while True:
+            chunk = await upload.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+            if spool_file is None and size > threshold:
+                path = new_spool_path(suffix, directory, size_hint)
+                spool_file = open(path, "wb")
+                await asyncio.to_thread(spool_file.writelines, chunks)
+                chunks = []
+            if spool_file is not None:
+                await asyncio.to_thread(spool_file.write, chunk)
+            else:
+                chunks.append(chunk)
+    except BaseException:
+        if spool_file is not None:
+            spool_file.close()
+            os.remove(path)
+        raise
+    if spool_file is not None:
+        spool_file.close()
+        return SpooledInput(path=path, size=size, sha256=digest.hexdigest())
+    return SpooledInput(data=b"".join(chunks), size=size, sha256=digest.hexdigest())
+
+
+def convert_into_file(func, source, output_path, *args, profile_path=None, **kwargs):
+    """Run a converter in a worker process, writing its output straight to ``output_path``.
+
+    ``source`` is a path or an in-memory buffer (see SpooledInput.source). Only the
+    output size and the converter's stage and per-step timings travel back to the API
+    process, never the converted bytes. With ``profile_path`` the call runs under the profiler.
+    """
+    try:
+        with metrics.collect(metrics.Timings()) as timings, metrics.profiled(profile_path):
+            with open(output_path, "wb") as output:
+                func(source, *args, output=output, **kwargs)
+        return os.path.getsize(output_path), timings.stages, timings.hops
+    except BaseException:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+
+
+def open_and_unlink(path):
+    # The open handle keeps the data readable; nothing is left behind if the client disconnects
+    f = open(path, "rb")
+    os.remove(path)
+    return f
+
+
+def iter_chunks(fileobj, chunk_size=CHUNK_SIZE):
+    """Yield a file object's contents in fixed-size chunks for a StreamingResponse."""
+    try:
+        while True:
+            chunk = fileobj.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        fileobj.close()
+
+
+# Outputs that are already compressed (ZIP containers, PDF streams) gain nothing from deflate
+_STORED_EXTENSIONS = (".docx", ".xlsx", ".zip", ".pdf")
+
+
+class _ZipStreamBuffer(io.RawIOBase):
+    # Unseekable sink for ZipFile; the generator drains what has been written so far
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self):
+        chunks, self._chunks = self._chunks, []
+        return chunks
+
+
+def iter_zip(entries, chunk_size=CHUNK_SIZE):
+    """Stream a ZIP archive built from ``(name, bytes or readable file object)`` entries.
+
+    Members are compressed and yielded as they are read, so the archive is never
+    held in memory as a whole. File objects are closed once written.
+    """
+    buffer = _ZipStreamBuffer()
+    try:
+        with zipfile.ZipFile(buffer, "w") as archive:
+            for name, content in entries:
+                info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+                stored = name.lower().endswith(_STORED_EXTENSIONS)
+                info.compress_type = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+                if isinstance(content, bytes):
+                    archive.writestr(info, content)
+                else:
+                    with archive.open(info, "w", force_zip64=True) as member:
+                        while True:
+                            chunk = content.read(chunk_size)
+                            if not chunk:
+                                break
+                            member.write(chunk)
+                            yield from buffer.drain()
+                    content.close()
+                yield from buffer.drain()
+        yield from buffer.drain()
+    finally:
+        for _, content in entries:
+            if not isinstance(content, bytes):
+                content.close()
@@ -0,0 +1,118 @@
+import io
+import os
+from bisect import bisect_right
+from functools import lru_cache
+from itertools import accumulate, islice
+
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen import canvas
+
+# Page layout, matching the original drawString loop
+FONT_NAME = "Helvetica"
+MARGIN = 50
+TOP = 750
+
+
+class _CharWidths(dict):
+    """Glyph advance widths of one font at one size, measured on first use.
+
+    Standard PDF fonts have no kerning, so a string's width is the sum of its
+    characters' widths; with the cache that sum runs at C speed via map().
+    """
+
+    def __init__(self, font_name, font_size):
+        super().__init__()
+        self.font_name = font_name
+        self.font_size = font_size
+        # Extremes over printable ASCII, used to skip or bound measuring a line
+        ascii_widths = [self[chr(c)] for c in range(32, 127)]
+        self.narrowest = min(ascii_widths)
+        self.widest = max(ascii_widths)
+
+    def __missing__(self, ch):
+        width = self[ch] = stringWidth(ch, self.font_name, self.font_size)
+        return width
+
+
+@lru_cache(maxsize=None)
+def _char_widths(font_name, font_size):
+    return _CharWidths(font_name, font_size)
+
+
+def wrap_line(line, max_width, font_name, font_size):
+    """Greedy word wrap of ``line`` to ``max_width`` points; returns the visual lines.
+
+    Words wider than a whole line are broken between characters.
+    """
+    widths = _char_widths(font_name, font_size)
+    width_of = widths.__getitem__
+    # Short ASCII lines fit whatever their glyphs, and most other lines fit too
+    if (len(line) * widths.widest <= max_width and line.isascii()) or sum(map(width_of, line)) <= max_width:
+        return [line]
+    # No more characters than this can fit on one line, so never measure past it
+    limit = int(max_width // widths.narrowest) + 1
+    lines = []
+    while True:
+        # Number of leading characters that fit, from the running width of the line
+        cut = bisect_right(list(accumulate(islice(map(width_of, line), limit))), max_width)
+        if cut >= len(line):
+            break
+        space = line.rfind(" ", 0, cut + 1)
+        if space > 0:
+            lines.append(line[:space])
+            line = line[space + 1:]
+        else:
+            cut = max(cut, 1) # Always make progress, even if one glyph is wider than the line
+            lines.append(line[:cut])
+            line = line[cut:]
+    lines.append(line)
+    return lines
+
+
+def _iter_source_lines(source):
+    # Stream the input line by line instead of decoding the whole file at once
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "r", encoding="utf-8") as f:
+            for line in f:
+                yield line.rstrip("\r\n")
+    else:
+        source.seek(0)
+        text = io.TextIOWrapper(source, encoding="utf-8")
+        try:
+            for line in text:
+                yield line.rstrip("\r\n")
+        finally:
+            text.detach() # Leave the caller's buffer open
+
+
+def render_text_pdf(source, result, font_size=12, font_name=FONT_NAME, pagesize=letter):
+    """Render a UTF-8 text file (path or binary stream) into a PDF written to ``result``.
+
+    Lines are wrapped to the page width and drawn through one text object per page
+    rather than one drawString call per line.
+    """
+    page_width, _ = pagesize
+    max_width = page_width - 2 * MARGIN
+    leading = font_size + 5 # Line spacing based on font size
+    lines_per_page = int((TOP - MARGIN) // leading) + 1
+
+    c = canvas.Canvas(result, pagesize=pagesize)
+    text = None
+    used = 0
+    for line in _iter_source_lines(source):
+        for visual_line in wrap_line(line, max_width, font_name, font_size):
+            if text is None:
+                text = c.beginText(MARGIN, TOP)
+                text.setFont(font_name, font_size, leading)
+            text.textLine(visual_line)
+            used += 1
+            if used == lines_per_page:
+                c.drawText(text)
+                c.showPage()
+                text = None
+                used = 0
+    if text is not None:
+        c.drawText(text)
+    c.save()
+    return result
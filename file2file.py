@@ -10,10 +10,14 @@ from reportlab.lib.pagesizes import letter
 import pypandoc
 import requests # For making HTTP requests to the FastAPI backend
 import json # For handling JSON responses
+import zipfile # For reading DOCX previews
+from xml.etree import ElementTree
+import hashlib
+import time
 
 # Import cloud storage functions
-from cloud_storage.google_drive import upload_to_google_drive
-from cloud_storage.dropbox_api import upload_to_dropbox
+from cloud_storage.google_drive import upload_to_google_drive, upload_many_to_google_drive
+from cloud_storage.dropbox_api import upload_to_dropbox, upload_many_to_dropbox
 
 st.set_page_config(page_title="File2File Converter SaaS", layout="centered")
 st.title("📁 File2File Converter SaaS")
@@ -28,6 +32,10 @@ DROPBOX_ACCESS_TOKEN = st.secrets.get("DROPBOX_ACCESS_TOKEN", "YOUR_DROPBOX_TOKE
 doc_types = ["pdf", "docx", "txt"]
 sheet_types = ["csv", "xls", "xlsx"]
 all_types = doc_types + sheet_types
+# Columnar formats the backend can write but that are not uploaded here
+output_only_types = ["parquet", "feather"]
+# One-table formats: a workbook with several sheets comes back as a ZIP with a file per sheet
+single_table_types = ["csv"] + output_only_types
 
 # --- UI for Format Selection and Upload ---
 st.subheader("Conversion Settings")
@@ -35,7 +43,7 @@ col1, col2 = st.columns(2)
 with col1:
     source_format = st.selectbox("From format", all_types)
 with col2:
-    target_format = st.selectbox("To format", [f for f in all_types if f != source_format])
+    target_format = st.selectbox("To format", [f for f in all_types + output_only_types if f != source_format])
 
 uploaded_files = st.file_uploader(
     "Upload files",
@@ -45,36 +53,104 @@ uploaded_files = st.file_uploader(
 
 custom_name = st.text_input("Optional: base name for output file(s)", "converted")
 
+# Exporting from the backend uploads the converted files straight to cloud storage with the
+# server's credentials, so they never have to travel through this app
+DELIVERY_OPTIONS = {
+    "Download here": None,
+    "Export to Dropbox from the server": "dropbox",
+    "Export to Google Drive from the server": "gdrive",
+}
+destination = DELIVERY_OPTIONS[st.selectbox("Deliver converted files", list(DELIVERY_OPTIONS))]
+
 # --- Preview Section ---
+PREVIEW_CHARS = 1000 # Characters of text shown for documents
+PREVIEW_ROWS = 5 # Rows shown for spreadsheets (like df.head())
+PREVIEW_MAX_PDF_PAGES = 10 # Stop looking for text after this many pages
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+# Run elements other than w:t that python-docx renders as text
+_DOCX_RUN_TEXT = {f"{_W}tab": "\t", f"{_W}br": "\n", f"{_W}cr": "\n"}
+
+def _truncate(text):
+    return text[:PREVIEW_CHARS] + ("..." if len(text) > PREVIEW_CHARS else "")
+
+def _preview_docx_text(file_bytes):
+    # Stream document.xml and stop after enough body paragraphs, instead of building the full DOM
+    paragraphs, length, parents = [], 0, []
+    with zipfile.ZipFile(BytesIO(file_bytes)) as archive, archive.open("word/document.xml") as xml:
+        for event, element in ElementTree.iterparse(xml, events=("start", "end")):
+            if event == "start":
+                parents.append(element.tag)
+                continue
+            parents.pop()
+            if element.tag == f"{_W}p" and parents and parents[-1] == f"{_W}body":
+                text = "".join(_DOCX_RUN_TEXT.get(node.tag, node.text if node.tag == f"{_W}t" else "") or ""
+                               for node in element.iter())
+                paragraphs.append(text)
+                length += len(text) + 1
+                element.clear()
+                if length > PREVIEW_CHARS:
+                    break
+    return "\n".join(paragraphs)
+
+def _preview_pdf_text(file_bytes):
+    # Extract page by page and stop once there is enough text to show
+    texts, length = [], 0
+    with pdfplumber.open(BytesIO(file_bytes)) as pdf:
+        for page in pdf.pages[:PREVIEW_MAX_PDF_PAGES]:
+            text = page.extract_text() or ""
+            page.close()
+            texts.append(text)
+            length += len(text) + 1
+            if length > PREVIEW_CHARS:
+                break
+    return "\n".join(texts)
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def build_preview(content_hash, file_type, _file_bytes):
+    """Parse just enough of a file to preview it, memoized on the hash of its content.
+
+    Returns ("text", str), ("table", DataFrame) or ("error", message). ``_file_bytes``
+    is not hashed by Streamlit; ``content_hash`` identifies it.
+    """
+    try:
+        if file_type == "txt":
+            # Decode only the head; an incomplete trailing character is dropped
+            head = _file_bytes[:PREVIEW_CHARS * 4 + 4].decode("utf-8", errors="ignore")
+            more = len(_file_bytes) > PREVIEW_CHARS * 4 + 4
+            return "text", head[:PREVIEW_CHARS] + ("..." if more or len(head) > PREVIEW_CHARS else "")
+        if file_type == "csv":
+            return "table", pd.read_csv(BytesIO(_file_bytes), nrows=PREVIEW_ROWS)
+        if file_type in ["xls", "xlsx"]:
+            return "table", pd.read_excel(BytesIO(_file_bytes), nrows=PREVIEW_ROWS)
+        if file_type == "docx":
+            return "text", _truncate(_preview_docx_text(_file_bytes))
+        if file_type == "pdf":
+            return "text", _truncate(_preview_pdf_text(_file_bytes))
+    except Exception as e:
+        return "error", f"Could not preview {file_type.upper()} file. It might be corrupted or in an unsupported format. Error: {e}"
+    return "error", f"No preview available for {file_type.upper()} files."
+
+def content_hash(file):
+    # Hash each upload once; reruns reuse it from session state
+    hashes = st.session_state.setdefault("upload_hashes", {})
+    file_id = getattr(file, "file_id", None)
+    if file_id is None or file_id not in hashes:
+        digest = hashlib.sha256(file.getbuffer()).hexdigest()
+        if file_id is None:
+            return digest
+        hashes[file_id] = digest
+    return hashes[file_id]
+
 def preview_file(file, file_type):
     st.subheader("🔍 Preview")
-    file.seek(0) # Reset file pointer for preview
-
-    if file_type == "txt":
-        text = file.read().decode("utf-8")
-        st.text(text[:1000] + ("..." if len(text) > 1000 else ""))
-    elif file_type == "csv":
-        df = pd.read_csv(file)
-        st.dataframe(df.head())
-    elif file_type in ["xls", "xlsx"]:
-        df = pd.read_excel(file)
-        st.dataframe(df.head())
-    elif file_type == "docx":
-        try:
-            doc_bytes = BytesIO(file.read())
-            doc = Document(doc_bytes)
-            text = "\n".join([p.text for p in doc.paragraphs])
-            st.text(text[:1000] + ("..." if len(text) > 1000 else ""))
-        except Exception as e:
-            st.warning(f"Could not preview DOCX file. It might be corrupted or in an unsupported format. Error: {e}")
-    elif file_type == "pdf":
-        try:
-            pdf_bytes = BytesIO(file.read())
-            with pdfplumber.open(pdf_bytes) as pdf:
-                text = "\n".join([page.extract_text() or "" for page in pdf.pages])
-                st.text(text[:1000] + ("..." if len(text) > 1000 else ""))
-        except Exception as e:
-            st.warning(f"Could not preview PDF file. It might be corrupted or in an unsupported format. Error: {e}")
+    kind, preview = build_preview(content_hash(file), file_type, file.getvalue())
+    if kind == "table":
+        st.dataframe(preview)
+    elif kind == "text":
+        st.text(preview)
+    else:
+        st.warning(preview)
 
 # --- Content Editing Section ---
 def edit_content(file_bytes, file_type):
@@ -116,39 +192,173 @@ def edit_content(file_bytes, file_type):
     return edited_content
 
 # --- Conversion Logic (Calls FastAPI Backend) ---
-def convert_file_via_api(file_bytes, original_filename, source_fmt, target_fmt):
-    st.info(f"Sending {original_filename} to backend for conversion from {source_fmt} to {target_fmt}...")
-    
-    files = {'file': (original_filename, file_bytes.getvalue(), 'application/octet-stream')}
-    data = {
-        'from_format': source_fmt,
-        'to_format': target_fmt,
-        'font_size': st.session_state.get('font_size', 12) # Pass font size from editing
-    }
+JOB_POLL_INTERVAL = 1.0 # Seconds between job status checks
+MAX_PARALLEL_REQUESTS = 4 # API calls in flight at the same time, across browser sessions
+API_TIMEOUT = 120 # Seconds before a single API call gives up
 
-    try:
-        response = requests.post(f"{FASTAPI_BACKEND_URL}/convert", files=files, data=data)
-        response.raise_for_status() # Raise an exception for HTTP errors (4xx or 5xx)
-        
-        # FastAPI returns the file directly as response content
-        converted_file_bytes = BytesIO(response.content)
-        st.success("Conversion successful!")
-        return converted_file_bytes
-    except requests.exceptions.ConnectionError:
+@st.cache_resource
+def get_api_session():
+    # One keep-alive connection pool shared by every script run and worker thread
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=MAX_PARALLEL_REQUESTS)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def call_api(method, path, **kwargs):
+    response = get_api_session().request(method, f"{FASTAPI_BACKEND_URL}{path}", timeout=API_TIMEOUT, **kwargs)
+    response.raise_for_status() # Raise an exception for HTTP errors (4xx or 5xx)
+    return response
+
+def report_api_error(e, response):
+    if isinstance(e, requests.exceptions.ConnectionError):
         st.error(f"❌ Could not connect to the backend API at {FASTAPI_BACKEND_URL}. Please ensure it is running.")
-        return None
-    except requests.exceptions.RequestException as e:
-        st.error(f"❌ API conversion failed: {e}")
-        if response is not None and response.content:
-            try:
-                error_detail = response.json().get("detail", "No specific error detail from API.")
-                st.error(f"API Error Detail: {error_detail}")
-            except json.JSONDecodeError:
-                st.error(f"API returned non-JSON error: {response.text}")
-        return None
+        return
+    st.error(f"❌ API conversion failed: {e}")
+    if response is not None and response.content:
+        try:
+            error_detail = response.json().get("detail", "No specific error detail from API.")
+            st.error(f"API Error Detail: {error_detail}")
+        except json.JSONDecodeError:
+            st.error(f"API returned non-JSON error: {response.text}")
+
+@st.cache_data(ttl=300)
+def conversion_route(source_fmt, target_fmt):
+    """The backend's route for a pair, e.g. "xlsx -> csv -> txt", or an error for unsupported pairs.
+
+    :return: (route description or None, error detail or None).
+    """
+    try:
+        response = call_api("get", "/converters", params={'from_format': source_fmt, 'to_format': target_fmt})
+    except requests.exceptions.HTTPError as e:
+        if e.response.status_code == 400:
+            return None, e.response.json().get("detail")
+        return None, None # Let the conversion itself report the problem
+    except requests.exceptions.RequestException:
+        return None, None
+    return response.json()["route"]["path"], None
+
+def conversion_key(content, source_fmt, target_fmt, font_size, destination=None, name=None):
+    # Identifies a conversion result: same bytes + same parameters = same output.
+    # Exports also depend on where the file goes and under which name.
+    key = hashlib.sha256(content.getbuffer())
+    key.update(f"{source_fmt}:{target_fmt}:{font_size}".encode("utf-8"))
+    if destination:
+        key.update(f":{destination}:{name}".encode("utf-8"))
+    return key.hexdigest()
+
+def submit_job(files, source_fmt, target_fmt, font_size, destination=None):
+    """Queue one backend job converting all ``files`` (list of (filename, BytesIO) pairs).
+
+    With a ``destination`` the backend uploads the results itself.
+    :return: the job id.
+    """
+    data = {'from_format': source_fmt, 'to_format': target_fmt, 'font_size': font_size}
+    if destination:
+        data['destination'] = destination
+    response = call_api("post", "/jobs", data=data,
+                        files=[('files', (name, content.getvalue(), 'application/octet-stream')) for name, content in files])
+    return response.json()["job_id"]
+
+def fetch_job_outputs(job_id, job):
+    """Converted bytes of a finished job's files, by file index, fetched in one request."""
+    response = call_api("get", f"/jobs/{job_id}/result")
+    if len(job["files"]) == 1:
+        return {0: response.content}
+    # Several files come back as one ZIP whose manifest names each file's entry
+    with zipfile.ZipFile(BytesIO(response.content)) as archive:
+        manifest = json.loads(archive.read("manifest.json"))
+        return {entry["index"]: archive.read(entry["output"]) for entry in manifest["files"] if entry["status"] == "ok"}
+
+def convert_files(files, source_fmt, target_fmt, destination=None):
+    """Convert files through the backend job API without blocking the script run.
+
+    The files that aren't converted yet are submitted together as one job. While it
+    runs, each script run checks its status once, shows per-file progress from the
+    job's file list and schedules another rerun. Outputs are kept in session state
+    keyed on content and parameters, so reruns (widget changes, cloud save buttons)
+    never convert the same file again.
+
+    :param files: list of (filename, BytesIO) pairs; when exporting, the filename
+        is the name the file gets in cloud storage.
+    :param destination: "dropbox" or "gdrive" to have the backend upload the results.
+    :return: list with a BytesIO of the converted output, or None, for each file.
+        Exported files are reported here (status and link) and returned as None.
+    """
+    font_size = st.session_state.get('font_size', 12) # Pass font size from editing
+    keys = [conversion_key(content, source_fmt, target_fmt, font_size, destination, name) for name, content in files]
+    results = st.session_state.setdefault("conversion_results", {}) # key -> {"output"}, {"export"} or {"error"}
+    jobs = st.session_state.setdefault("conversion_jobs", {}) # job id -> {"keys": key of each job file, "job": status}
+    # Forget files that are no longer uploaded (or were edited) so session state stays small
+    for key in [key for key in results if key not in keys]:
+        del results[key]
+    for job_id in [job_id for job_id, entry in jobs.items() if not set(entry["keys"]) & set(keys)]:
+        del jobs[job_id]
+
+    submitted = {key for entry in jobs.values() for key in entry["keys"]}
+    pending = {}
+    for key, file in zip(keys, files):
+        if key not in results and key not in submitted:
+            pending.setdefault(key, file) # The same file uploaded twice is converted once
+    if pending:
+        try:
+            job_id = submit_job(list(pending.values()), source_fmt, target_fmt, font_size, destination)
+            jobs[job_id] = {"keys": list(pending), "job": None}
+        except requests.exceptions.RequestException as e:
+            report_api_error(e, e.response)
+
+    for job_id, entry in list(jobs.items()):
+        try:
+            job = entry["job"] = call_api("get", f"/jobs/{job_id}").json()
+            if job["status"] not in ("done", "failed"):
+                continue
+            outputs = fetch_job_outputs(job_id, job) if job["status"] == "done" and not destination else {}
+        except requests.exceptions.RequestException as e:
+            del jobs[job_id] # Resubmit on the next run (e.g. the backend was reset)
+            report_api_error(e, e.response)
+            continue
+        for key, record in zip(entry["keys"], job["files"]):
+            if record["status"] != "done":
+                results[key] = {"error": record["detail"] or job["error"]}
+            elif destination:
+                results[key] = {"export": record["export"]}
+            else:
+                results[key] = {"output": outputs[record["index"]]}
+        del jobs[job_id]
+
+    if jobs:
+        statuses = {} # key -> status of its file in a running job
+        for entry in jobs.values():
+            for key, record in zip(entry["keys"], entry["job"]["files"]):
+                running = record["status"] == "queued" and entry["job"]["status"] == "running"
+                statuses[key] = "running" if running else record["status"]
+        for (name, _), key in zip(files, keys):
+            status = "done" if key in results else statuses.get(key, "queued")
+            if status in ("done", "failed"):
+                st.progress(1.0, text=f"{name}: {status}")
+            else:
+                st.progress(0.5 if status == "running" else 0.0, text=f"{name}: {status}...")
+        time.sleep(JOB_POLL_INTERVAL)
+        st.rerun()
+
+    outputs = []
+    for (name, _), key in zip(files, keys):
+        result = results.get(key, {})
+        if "error" in result:
+            st.error(f"❌ Conversion of {name} failed: {result['error']}")
+        elif "export" in result:
+            export = result["export"] or {"status": "failed", "detail": "The backend did not export the file."}
+            if export["status"] == "done":
+                link = f" [Open]({export['link']})" if export.get("link") else ""
+                st.success(f"✅ {name} converted and saved to {export['destination']}.{link}")
+            else:
+                st.error(f"❌ {name} was converted but the upload failed: {export['detail']}")
+        outputs.append(BytesIO(result["output"]) if "output" in result else None)
+    return outputs
 
 # --- Main Conversion and Download Section ---
 if uploaded_files:
+    edited_files = []
     for idx, uploaded_file in enumerate(uploaded_files):
         st.divider()
         st.subheader(f"📄 File {idx + 1}: {uploaded_file.name}")
@@ -160,23 +370,37 @@ if uploaded_files:
         # Pass a copy of the uploaded file's BytesIO to editing to avoid pointer issues
         uploaded_file_copy_for_editing = BytesIO(uploaded_file.getvalue())
         edited_file_content = edit_content(uploaded_file_copy_for_editing, source_format)
+        edited_files.append((uploaded_file.name, edited_file_content))
 
-        # 3. Perform conversion via backend API
-        output = None
-        if source_format in doc_types and target_format in doc_types:
-            with st.spinner("Converting document file..."):
-                output = convert_file_via_api(edited_file_content, uploaded_file.name, source_format, target_format)
-        elif source_format in sheet_types and target_format in sheet_types:
-            with st.spinner("Converting spreadsheet file..."):
-                output = convert_file_via_api(edited_file_content, uploaded_file.name, source_format, target_format)
+    download_names = []
+    for idx, uploaded_file in enumerate(uploaded_files):
+        file_base = custom_name if custom_name else os.path.splitext(uploaded_file.name)[0]
+        download_names.append(f"{file_base}_{idx + 1}.{target_format}" if len(uploaded_files) > 1 else f"{file_base}.{target_format}")
+
+    # 3. Perform conversion via a backend job covering all files
+    outputs = []
+    route, route_error = conversion_route(source_format, target_format)
+    if route_error is None:
+        if route and route.count("->") > 1:
+            st.caption(f"Converted in steps: {route}")
+        if destination:
+            # Exported under their download names, straight from the backend
+            st.divider()
+            outputs = convert_files([(download_name, content) for download_name, (_, content) in zip(download_names, edited_files)],
+                                    source_format, target_format, destination)
         else:
-            st.error("❌ Cross-type conversions (e.g., DOCX → CSV) not supported.")
-            continue
+            outputs = convert_files(edited_files, source_format, target_format)
+    else:
+        st.error(f"❌ {route_error}")
 
+    converted = [] # (download_name, output) of every successful conversion
+    for idx, (download_name, output) in enumerate(zip(download_names, outputs)):
         # 4. Provide download and cloud save options
         if output:
-            file_base = custom_name if custom_name else os.path.splitext(uploaded_file.name)[0]
-            download_name = f"{file_base}_{idx + 1}.{target_format}" if len(uploaded_files) > 1 else f"{file_base}.{target_format}"
+            st.divider()
+            if target_format in single_table_types and output.getvalue()[:4] == b"PK\x03\x04":
+                download_name = f"{os.path.splitext(download_name)[0]}.zip"
+            converted.append((download_name, output))
 
             st.success(f"✅ Conversion Done: {download_name}")
             
@@ -187,21 +411,54 @@ if uploaded_files:
             # Cloud Storage Buttons
             with col_gdrive:
                 if st.button("☁️ Save to Google Drive", key=f"gdrive_btn_{idx}"):
-                    with st.spinner("Uploading to Google Drive..."):
-                        try:
-                            upload_to_google_drive(output.getvalue(), download_name)
-                            st.success("Uploaded to Google Drive!")
-                        except Exception as e:
-                            st.error(f"Google Drive upload failed: {e}")
+                    upload_progress = st.progress(0.0, text="Uploading to Google Drive...")
+                    try:
+                        uploaded = upload_to_google_drive(output.getvalue(), download_name,
+                                                          progress=lambda sent, total: upload_progress.progress(sent / max(total, 1), text="Uploading to Google Drive..."))
+                        st.success(f"Uploaded to Google Drive! [Open]({uploaded.get('webViewLink')})" if uploaded.get('webViewLink') else "Uploaded to Google Drive!")
+                    except Exception as e:
+                        st.error(f"Google Drive upload failed: {e}")
             
             with col_dropbox:
                 if st.button("☁️ Save to Dropbox", key=f"dropbox_btn_{idx}"):
-                    with st.spinner("Uploading to Dropbox..."):
-                        try:
-                            # Dropbox API expects bytes
-                            upload_to_dropbox(DROPBOX_ACCESS_TOKEN, output.getvalue(), f"/{download_name}")
-                            st.success("Uploaded to Dropbox!")
-                        except Exception as e:
-                            st.error(f"Dropbox upload failed: {e}")
+                    upload_progress = st.progress(0.0, text="Uploading to Dropbox...")
+                    try:
+                        # Large files are sent in chunks; the bar follows them
+                        upload_to_dropbox(DROPBOX_ACCESS_TOKEN, output.getvalue(), f"/{download_name}",
+                                          progress=lambda sent, total: upload_progress.progress(sent / max(total, 1), text="Uploading to Dropbox..."))
+                        st.success("Uploaded to Dropbox!")
+                    except Exception as e:
+                        st.error(f"Dropbox upload failed: {e}")
+
+    # 5. Save every converted file at once: concurrently to Google Drive, in one batch commit to Dropbox
+    if len(converted) > 1:
+        st.divider()
+        col_gdrive_all, col_dropbox_all = st.columns(2)
+        with col_gdrive_all:
+            save_all_gdrive = st.button(f"☁️ Save all {len(converted)} files to Google Drive", key="gdrive_all_btn")
+        with col_dropbox_all:
+            save_all_dropbox = st.button(f"☁️ Save all {len(converted)} files to Dropbox", key="dropbox_all_btn")
+        if save_all_gdrive:
+            with st.spinner("Uploading to Google Drive..."):
+                try:
+                    results = upload_many_to_google_drive([(output.getvalue(), name) for name, output in converted])
+                    failed = [(name, result) for (name, _), result in zip(converted, results) if isinstance(result, Exception)]
+                    for name, error in failed:
+                        st.error(f"Google Drive upload of {name} failed: {error}")
+                    if len(failed) < len(converted):
+                        st.success(f"Uploaded {len(converted) - len(failed)} file(s) to Google Drive!")
+                except Exception as e:
+                    st.error(f"Google Drive upload failed: {e}")
+        if save_all_dropbox:
+            with st.spinner("Uploading to Dropbox..."):
+                try:
+                    results = upload_many_to_dropbox(DROPBOX_ACCESS_TOKEN, [(output.getvalue(), f"/{name}") for name, output in converted])
+                    failed = [(name, result) for (name, _), result in zip(converted, results) if isinstance(result, Exception)]
+                    for name, error in failed:
+                        st.error(f"Dropbox upload of {name} failed: {error}")
+                    if len(failed) < len(converted):
+                        st.success(f"Uploaded {len(converted) - len(failed)} file(s) to Dropbox!")
+                except Exception as e:
+                    st.error(f"Dropbox upload failed: {e}")
 
  